@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Union
+
+from ratelimit import TokenBucket
+
+# Оповещения администратора об ошибках.
+# Обработчик ошибок только кладёт исключение в память (record() не ждёт ни сети, ни базы),
+# а фоновая задача раз в окно отправляет сводки через outbox. Одинаковые ошибки — тот же тип, то же место
+# в коде и тот же текст с точностью до чисел — склеиваются: о новой ошибке администратор узнаёт сразу,
+# о повторах — одним сообщением со счётчиком за окно. Сообщений не больше max_per_minute в минуту,
+# остальное ждёт следующего окна, поэтому сбой Bot API, который повторяется на каждом апдейте, не заваливает чат.
+
+# Сколько ошибок разных видов помнить; давно не повторявшиеся забываются
+MAX_INCIDENTS = 500
+FORGET_AFTER = 3600.0
+# Хвост трейсбека в сообщении (лимит Telegram — 4096 символов на сообщение)
+MAX_DETAILS = 2500
+
+
+class Incident:
+    __slots__ = ("fingerprint", "title", "where", "details", "context", "first_seen", "last_seen", "total", "unreported", "reported_at")
+
+    def __init__(self, fingerprint: str, title: str, where: str, details: str, now: float) -> None:
+        self.fingerprint = fingerprint
+        self.title = title
+        self.where = where
+        self.details = details
+        # Описание последнего апдейта (или задачи), на котором случилась ошибка
+        self.context = ""
+        self.first_seen = self.last_seen = now
+        self.total = 0
+        # Повторы, о которых администратор ещё не знает; reported_at None — ещё не сообщали ни разу
+        self.unreported = 0
+        self.reported_at: Optional[float] = None
+
+
+def _location(error: BaseException) -> str:
+    frames = traceback.extract_tb(error.__traceback__)
+    if not frames:
+        return "?"
+    # Последний кадр в коде бота точнее указывает на причину, чем кадр внутри библиотеки.
+    # Код бота — модули в корне проекта; всё глубже (.venv/, venv/ с telegram и httpx) к нему не относится
+    here = os.path.dirname(os.path.abspath(__file__))
+    own = [frame for frame in frames if os.path.dirname(os.path.abspath(frame.filename)) == here]
+    frame = (own or frames)[-1]
+    return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+
+
+def fingerprint(error: BaseException) -> str:
+    # Числа в тексте (ID чатов, retry_after, номера портов) не делают ошибку новой
+    message = re.sub(r"\d+", "N", str(error))[:200]
+    kind = type(error)
+    key = f"{kind.__module__}.{kind.__qualname__}|{_location(error)}|{message}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+class ErrorAlerts:
+    def __init__(
+        self,
+        outbox,
+        chat_id: Optional[Union[int, str]],
+        describe: Callable[[Incident, float], str],
+        window: float = 60.0,
+        max_per_minute: float = 5,
+    ) -> None:
+        # describe(incident, window) -> текст оповещения; без chat_id ошибки только пишутся в лог
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.describe = describe
+        self.window = window
+        # Запас в один токен: иначе полный запас на старте и пополнение за минуту дали бы почти вдвое больше лимита
+        self._bucket = TokenBucket(rate=max_per_minute / 60, capacity=1.0)
+        self._incidents: Dict[str, Incident] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, error: BaseException, context: str = "", now: Optional[float] = None) -> Incident:
+        now = now or time.time()
+        key = fingerprint(error)
+        incident = self._incidents.get(key)
+        if incident is None:
+            if len(self._incidents) >= MAX_INCIDENTS:
+                self._forget(now)
+            details = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+            incident = self._incidents[key] = Incident(
+                key, f"{type(error).__name__}: {error}"[:300], _location(error), details[-MAX_DETAILS:], now,
+            )
+            # О новой ошибке сообщаем, не дожидаясь конца окна
+            if self._wakeup is not None:
+                self._wakeup.set()
+        incident.context = context
+        incident.last_seen = now
+        incident.total += 1
+        incident.unreported += 1
+        return incident
+
+    def pending_count(self) -> int:
+        return sum(1 for incident in self._incidents.values() if incident.unreported)
+
+    def _forget(self, now: float) -> None:
+        stale = [
+            key for key, incident in self._incidents.items()
+            if not incident.unreported and now - incident.last_seen >= FORGET_AFTER
+        ]
+        if not stale:
+            # Всё свежее — забываем те, что дольше всех не повторялись
+            stale = sorted(self._incidents, key=lambda key: self._incidents[key].last_seen)[:MAX_INCIDENTS // 10]
+        for key in stale:
+            del self._incidents[key]
+
+    def due(self, now: Optional[float] = None) -> List[Incident]:
+        # Новые ошибки — сразу, повторы уже известных — не чаще раза в окно; новые и частые первыми
+        now = now or time.time()
+        incidents = [
+            incident for incident in self._incidents.values()
+            if incident.unreported and (incident.reported_at is None or now - incident.reported_at >= self.window)
+        ]
+        incidents.sort(key=lambda incident: (incident.reported_at is not None, -incident.unreported))
+        return incidents
+
+    async def send_due(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        sent = 0
+        for incident in self.due(now):
+            if not self._bucket.try_acquire():
+                # Лимит оповещений исчерпан: счётчики копятся и уйдут в следующем окне одним сообщением
+                break
+            text = self.describe(incident, self.window)
+            # Счётчик сбрасываем до ожидания записи: повторы, пришедшие за это время, попадут в следующую сводку
+            incident.reported_at = now
+            incident.unreported = 0
+            await asyncio.to_thread(self.outbox.enqueue, self.chat_id, text)
+            sent += 1
+        return sent
+
+    def start(self) -> None:
+        if self._task is None and self.chat_id:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.send_due()
+            except Exception as e:
+                # Сбой оповещений не должен останавливать сами оповещения
+                logging.error(f"Failed to queue error alerts: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_check())
+            except asyncio.TimeoutError:
+                pass
+
+    def _next_check(self) -> float:
+        # Ближайший момент, когда накопленные повторы можно отправить или восстановится лимит
+        now = time.time()
+        waits = [
+            incident.reported_at + self.window - now
+            for incident in self._incidents.values() if incident.unreported and incident.reported_at is not None
+        ]
+        if any(incident.unreported and incident.reported_at is None for incident in self._incidents.values()):
+            waits.append(self._bucket.delay())
+        return max(1.0, min(waits, default=self.window))
@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qsl
+
+from webserver import HttpServer, Request, Response
+
+# Локальная заглушка Bot API для нагрузочного стенда.
+# Отвечает на методы, которые вызывает бот, правдоподобными объектами и считает вызовы по методам.
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "XENON PRIVE", "username": "xenon_prive_bench_bot"}
+
+_MESSAGE_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup")
+_TRUE_METHODS = ("answerCallbackQuery", "setWebhook", "deleteWebhook", "setMyCommands", "deleteMyCommands")
+
+
+class FakeBotApi:
+    def __init__(self, token: str, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0) -> None:
+        self.token = token
+        self.latency = latency
+        self.calls: Counter = Counter()
+        # Отправленные сообщения по chat_id — чтобы отдельно видеть нагрузку на админский чат
+        self.sent_to: Counter = Counter()
+        # Чаты, которые «заблокировали бота»: sendMessage в них отвечает 403
+        self.blocked_chats: Set[int] = set()
+        self._message_ids = itertools.count(1_000_000)
+        self._server = HttpServer(host, port)
+        self._server.route("POST", f"/bot{token}/getMe", self._get_me)
+        for method in _MESSAGE_METHODS:
+            self._server.route("POST", f"/bot{token}/{method}", self._make_message_route(method))
+        for method in _TRUE_METHODS:
+            self._server.route("POST", f"/bot{token}/{method}", self._make_true_route(method))
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self._server.host}:{self._server.port}/bot"
+
+    async def start(self) -> None:
+        await self._server.start()
+        if self._server.port == 0:
+            # Узнаём порт, выбранный системой
+            self._server.port = self._server._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self._server.stop()
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.sent_to.clear()
+
+    @staticmethod
+    def _params(request: Request) -> Dict[str, object]:
+        params: Dict[str, object] = {}
+        for key, value in parse_qsl(request.body.decode("utf-8")):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _ok(result: object) -> Response:
+        return Response(200, json.dumps({"ok": True, "result": result}).encode(), "application/json")
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _get_me(self, request: Request) -> Response:
+        self.calls["getMe"] += 1
+        return self._ok(BOT_USER)
+
+    def _make_message_route(self, method: str):
+        async def route(request: Request) -> Response:
+            self.calls[method] += 1
+            await self._delay()
+            params = self._params(request)
+            if method == "sendMessage":
+                if params.get("chat_id") in self.blocked_chats:
+                    body = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+                    return Response(403, json.dumps(body).encode(), "application/json")
+                self.sent_to[str(params.get("chat_id"))] += 1
+            message_id: Optional[object] = params.get("message_id")
+            message = {
+                "message_id": message_id if message_id is not None else next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            return self._ok(message)
+        return route
+
+    def _make_true_route(self, method: str):
+        async def route(request: Request) -> Response:
+            self.calls[method] += 1
+            await self._delay()
+            return self._ok(True)
+        return route
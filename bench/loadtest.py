@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# Нагрузочный стенд: прогоняет тысячи виртуальных пользователей через полную воронку записи
+# (start → start_signup → name_handler … → confirm_send_handler, включая цикл редактирования)
+# против локальной заглушки Bot API и печатает пропускную способность, перцентили задержки
+# и число вызовов Bot API на одну завершённую запись.
+#
+# Запуск из корня репозитория:
+#     python -m bench.loadtest --users 2000 --concurrency 200
+
+BENCH_TOKEN = "123456:BENCHMARK-TOKEN"
+ADMIN_CHAT_ID = "-1000000000001"
+# Окна по 15 минут круглые сутки: каждому виртуальному пользователю достаётся своё
+_BENCH_SLOT_MINUTES = 15
+# Группа, в которой стенд отмечает, что апдейт полностью обработан
+_DONE_GROUP = 1_000_000
+# ID подписчиков фоновой рассылки (--broadcast); каждый 50-й «заблокировал бота»
+_BROADCAST_BASE_ID = 5_000_000
+_BROADCAST_BLOCKED_EVERY = 50
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+
+def _message(user_id: int, text: Optional[str] = None, contact: Optional[dict] = None) -> dict:
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if contact is not None:
+        message["contact"] = contact
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def _callback(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "…",
+            },
+        },
+    }
+
+
+# Сценарий одного пользователя: (название шага, апдейт)
+def signup_script(user_id: int, edits: int, slot_start: int) -> List[Tuple[str, dict]]:
+    script = [
+        ("start", _message(user_id, "/start")),
+        ("start_signup", _callback(user_id, "signup")),
+        ("name_handler", _message(user_id, f"Пользователь {user_id}")),
+        ("phone_handler", _message(user_id, contact={"phone_number": f"+7900{user_id:07d}", "first_name": "U"})),
+        ("time_slot_handler", _callback(user_id, f"slot_{slot_start}")),
+        ("address_handler", _message(user_id, "Москва, Патриаршие пруды")),
+        ("format_handler_conv", _callback(user_id, "format_3")),
+        ("comment_handler", _message(user_id, "Без комментариев")),
+    ]
+    for _ in range(edits):
+        script += [
+            ("edit_data_handler", _callback(user_id, "edit_data")),
+            ("choose_field_handler", _callback(user_id, "edit_name")),
+            ("new_value_handler", _message(user_id, f"Исправленное имя {user_id}")),
+        ]
+    script.append(("confirm_send_handler", _callback(user_id, "confirm_send")))
+    return script
+
+
+class LoadTest:
+    def __init__(
+        self,
+        users: int,
+        concurrency: int,
+        edits: int,
+        api_latency: float,
+        living: bool = False,
+        digest: int = 0,
+        broadcast: int = 0,
+    ) -> None:
+        self.users = users
+        self.concurrency = concurrency
+        self.edits = edits
+        self.api_latency = api_latency
+        self.living = living
+        self.digest = digest
+        self.broadcast = broadcast
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.completed = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    async def _on_processed(self, update, context) -> None:
+        future = self._pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def _send(self, application, step: str, data: dict) -> None:
+        from telegram import Update
+
+        update = Update.de_json(data, application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update.update_id] = future
+        started = time.perf_counter()
+        await application.enqueue(update)
+        await asyncio.wait_for(future, timeout=30)
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def _run_user(self, application, user_id: int, slot_start: int, limiter: asyncio.Semaphore) -> None:
+        async with limiter:
+            for step, data in signup_script(user_id, self.edits, slot_start):
+                await self._send(application, step, data)
+            self.completed += 1
+
+    async def run(self) -> None:
+        os.environ["ADMIN_CHAT_ID"] = ADMIN_CHAT_ID
+        # Стенд меряет обработчики, а не лимит группового чата
+        os.environ["ADMIN_MESSAGES_PER_MINUTE"] = "1000000"
+        # Виртуальные пользователи отвечают мгновенно — защита от флуда отбросила бы их апдейты
+        os.environ.setdefault("FLOOD_RATE", "0")
+        os.environ["LIVING_MESSAGE"] = "1" if self.living else "0"
+        # Дайджест с короткой задержкой, все заявки несрочные: окна стенда начинаются прямо сейчас
+        os.environ["ADMIN_DIGEST_SIZE"] = str(self.digest)
+        os.environ["ADMIN_DIGEST_MAX_DELAY"] = "1"
+        os.environ["ADMIN_DIGEST_URGENT_HOURS"] = "0"
+        workdir = tempfile.mkdtemp(prefix="xenon-bench-")
+        os.environ["SCHEDULE_PATH"] = self._write_schedule(workdir)
+
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        from bench.fake_bot_api import FakeBotApi
+        from bot import build_application
+
+        # Логи каждого HTTP-запроса искажают замеры
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        api = FakeBotApi(BENCH_TOKEN, latency=self.api_latency)
+        await api.start()
+        application = build_application(
+            BENCH_TOKEN,
+            webhook_mode=True,
+            db_path=os.path.join(workdir, "bench.db"),
+            base_url=api.base_url,
+        )
+        application.add_handler(TypeHandler(Update, self._on_processed), group=_DONE_GROUP)
+
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            api.reset()
+            if self.broadcast:
+                self._start_broadcast(application, api)
+
+            slots = application.bot_data["slots"].free_slots(self.users)
+            limiter = asyncio.Semaphore(self.concurrency)
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self._run_user(application, 10_000 + i, slot.start, limiter) for i, slot in enumerate(slots)
+            ))
+            elapsed = time.perf_counter() - started
+
+            broadcast = application.bot_data["broadcaster"].running() if self.broadcast else None
+
+            # Ждём, пока outbox доставит все заявки (и дайджест их отдаст), чтобы учесть их в вызовах API
+            outbox = application.bot_data["outbox"]
+            digest = application.bot_data["digest"]
+            while outbox.pending_count() or (digest is not None and digest.pending_count()):
+                await asyncio.sleep(0.05)
+
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await api.stop()
+        broadcast_sent = sum(count for chat_id, count in api.sent_to.items() if int(chat_id) >= _BROADCAST_BASE_ID)
+        # Сообщения рассылки не относятся к воронке записи
+        api.calls["sendMessage"] -= broadcast_sent
+        self.report(elapsed, api.calls, api.sent_to[ADMIN_CHAT_ID])
+        if broadcast is not None:
+            print(f"Broadcast during the run: {broadcast.sent} of {broadcast.total} sent "
+                  f"({broadcast.sent / elapsed:.1f} msg/s), {broadcast.blocked} blocked the bot")
+
+    def _start_broadcast(self, application, api) -> None:
+        # Подписчики для фоновой рассылки, которая идёт одновременно с записью
+        subscribers = application.bot_data["subscribers"]
+        for i in range(self.broadcast):
+            subscribers.add(_BROADCAST_BASE_ID + i, _BROADCAST_BASE_ID + i, "ru", "bench")
+        api.blocked_chats = {_BROADCAST_BASE_ID + i for i in range(0, self.broadcast, _BROADCAST_BLOCKED_EVERY)}
+        application.bot_data["broadcaster"].create("Новости XENON PRIVE", ADMIN_CHAT_ID)
+
+    def _write_schedule(self, workdir: str) -> str:
+        slots_per_day = 24 * 60 // _BENCH_SLOT_MINUTES
+        schedule = {
+            "timezone": "UTC",
+            "slot_minutes": _BENCH_SLOT_MINUTES,
+            "horizon_days": self.users // slots_per_day + 2,
+            "weekly": {day: [["00:00", "23:59"]] for day in ("mon", "tue", "wed", "thu", "fri", "sat", "sun")},
+        }
+        path = os.path.join(workdir, "schedule.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(schedule, f)
+        return path
+
+    def report(self, elapsed: float, calls, admin_messages: int) -> None:
+        updates = sum(len(values) for values in self.latencies.values())
+        print(f"Users: {self.users}, concurrency: {self.concurrency}, edit rounds: {self.edits}, "
+              f"API latency: {self.api_latency * 1000:.0f} ms, living message: {'on' if self.living else 'off'}, "
+              f"admin digest: {self.digest or 'off'}, broadcast: {self.broadcast or 'off'}")
+        print(f"Completed signups: {self.completed} in {elapsed:.2f} s "
+              f"({self.completed / elapsed:.1f} signups/s, {updates / elapsed:.0f} updates/s)")
+        print()
+        print(f"{'step':<24}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        all_latencies: List[float] = []
+        for step, values in self.latencies.items():
+            all_latencies += values
+            self._print_row(step, values)
+        self._print_row("all updates", all_latencies)
+        print()
+        total_calls = sum(calls.values())
+        per_signup = total_calls / self.completed if self.completed else 0.0
+        print(f"Bot API calls per completed signup: {per_signup:.2f}")
+        for method, count in calls.most_common():
+            print(f"    {method:<28}{count / max(self.completed, 1):>8.2f}")
+        print(f"Admin chat messages: {admin_messages} for {self.completed} signups")
+
+    @staticmethod
+    def _print_row(step: str, values: List[float]) -> None:
+        if not values:
+            return
+        ordered = sorted(values)
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+        print(f"{step:<24}{len(values):>8}{statistics.median(ordered) * 1000:>10.2f}"
+              f"{percentile(0.90):>10.2f}{percentile(0.99):>10.2f}{ordered[-1] * 1000:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline load test of the XENON PRIVE signup funnel")
+    parser.add_argument("--users", type=int, default=1000, help="number of simulated users")
+    parser.add_argument("--concurrency", type=int, default=100, help="users in flight at the same time")
+    parser.add_argument("--edits", type=int, default=1, help="edit-loop rounds per signup")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, ms")
+    parser.add_argument("--living", action="store_true", help="enable the single living-message UI mode")
+    parser.add_argument("--digest", type=int, default=0, help="send admin notifications as digests of N leads")
+    parser.add_argument("--broadcast", type=int, default=0, help="run a broadcast to N subscribers during the test")
+    args = parser.parse_args()
+    asyncio.run(LoadTest(
+        args.users, args.concurrency, args.edits, args.api_latency / 1000, args.living, args.digest, args.broadcast,
+    ).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,34 @@
 import os
+import json
+import signal
+import asyncio
 import logging
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ConversationHandler, filters, ContextTypes
-# Заглушка для Render — чтобы не падал с ошибкой "no open ports"
-import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
-class PingHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"XENON PRIVE bot is alive")
-
-def start_dummy_server():
-    port = int(os.environ.get("PORT", 10000))
-    server = HTTPServer(("0.0.0.0", port), PingHandler)
-    server.serve_forever()
-
-threading.Thread(target=start_dummy_server, daemon=True).start()
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, MessageHandler, ConversationHandler, TypeHandler, filters, ContextTypes
+from alerts import ErrorAlerts, Incident
+from broadcast import BroadcastProgress, Broadcaster, SubscriberStore
+from catalog import FormatOption, format_price, get_catalog, reload_catalog
+from concurrency import MAX_PENDING_TASKS, OrderedApplication
+from digest import MAX_MESSAGE_LENGTH, AdminDigest
+from drafts import DRAFT_KEY, Draft, get_draft
+from flood import FloodControl
+from funnel import MAIN_PATH, STEPS, FunnelStats, reached, track_transitions
+from leads import LeadStore
+from metrics import REGISTRY, THROTTLED_UPDATES, Gauge, InstrumentedRequest, LoopMonitor, instrument_handlers
+from outbox import AdminOutbox
+from persistence import SQLitePersistence
+from sharding import ShardedApplication, SQLiteStateStore, StateStore
+from slots import Schedule, SlotBook, load_schedule, schedule_path
+from startup import StartupProfile
+from storage import database_path
+from templates import DEFAULT_LANGUAGE, Locale, get_templates
+from webserver import HttpServer, Request, Response
 
 # Загрузка переменных окружения из .env (если файл присутствует)
 load_dotenv()
@@ -28,133 +38,453 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 # Константы состояний для ConversationHandler
 NAME, PHONE, TIME, ADDRESS, FORMAT_STATE, COMMENT, CONFIRM, CHOOSE_FIELD, NEW_VALUE = range(9)
+# Имена состояний для метрик и логов
+STATE_NAMES = {
+    NAME: "NAME", PHONE: "PHONE", TIME: "TIME", ADDRESS: "ADDRESS", FORMAT_STATE: "FORMAT_STATE",
+    COMMENT: "COMMENT", CONFIRM: "CONFIRM", CHOOSE_FIELD: "CHOOSE_FIELD", NEW_VALUE: "NEW_VALUE",
+}
+
+# Пороги health-check: задержка event loop и давность последнего успешного запроса к Bot API
+HEALTH_MAX_LOOP_LAG = 1.0
+HEALTH_API_PROBE_AGE = 60.0
+
+# Имя задачи JobQueue, которая отправляет дайджест по истечении максимальной задержки,
+# и как часто каждый воркер проверяет, что такая задача у накопленных заявок есть
+DIGEST_TIMER_JOB = "admin_digest_timer"
+DIGEST_WATCH_JOB = "admin_digest_watch"
+DIGEST_WATCH_INTERVAL = 30.0
+
+# Задача чистки брошенных черновиков и пауза между напоминаниями (~10 сообщений в секунду)
+DRAFT_SWEEP_JOB = "drafts_sweep"
+DRAFT_REMINDER_PAUSE = 0.1
+
+# Сколько заявок /leads N показывает за раз
+LEADS_MAX_ROWS = 50
+
+# Период /stats по умолчанию и наибольший, дней (слишком большой период переполняет timedelta)
+STATS_DEFAULT_DAYS = 7
+STATS_MAX_DAYS = 3660
+
+# Тексты на языке пользователя (language_code из Telegram); для неизвестного языка — язык по умолчанию
+def texts_for(update: Update) -> Locale:
+    user = update.effective_user
+    return get_templates().get(user.language_code if user else None)
+
+
+# Тексты для админского чата: уведомления, дайджест, команды и ошибки — на языке ADMIN_LANGUAGE
+def admin_texts() -> Locale:
+    return get_templates().get(os.getenv("ADMIN_LANGUAGE", DEFAULT_LANGUAGE))
+
+
+# Клавиатуры не меняются, поэтому собираем их один раз на язык
+@lru_cache(maxsize=None)
+def main_menu_keyboard(texts: Locale) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(texts("menu_about"), callback_data="about")],
+        [InlineKeyboardButton(texts("menu_benefits"), callback_data="benefits")],
+        [InlineKeyboardButton(texts("menu_choose_format"), callback_data="choose_format")],
+        [InlineKeyboardButton(texts("menu_signup"), callback_data="signup")],
+        [InlineKeyboardButton(texts("menu_channel"), url="https://t.me/xenonprive")]
+    ])
 
-# Вспомогательная функция для формирования сводки заявки из user_data
-def compose_summary(user_data: dict, prefix: str = "Проверьте, пожалуйста, ваши данные:\n") -> str:
-    name = user_data.get('name')
-    phone = user_data.get('phone')
-    time = user_data.get('time')
-    address = user_data.get('address')
-    format_label = user_data.get('format_label')
-    format_price = user_data.get('format_price')
-    comment = user_data.get('comment') or ''
-    # Если комментария нет, указываем "нет"
-    comment_display = comment if comment and comment.strip() else "нет"
-    summary_text = (
-        f"{prefix}"
-        f"Имя: {name}\n"
-        f"Телефон: {phone}\n"
-        f"Удобное время: {time}\n"
-        f"Адрес: {address}\n"
-        f"Формат: {format_label} — {format_price}\n"
-        f"Комментарий: {comment_display}"
+
+@lru_cache(maxsize=None)
+def confirm_keyboard(texts: Locale) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(texts("confirm_send"), callback_data="confirm_send")],
+        [InlineKeyboardButton(texts("confirm_edit"), callback_data="edit_data")]
+    ])
+
+
+@lru_cache(maxsize=None)
+def edit_fields_keyboard(texts: Locale) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(texts("field_name"), callback_data="edit_name"), InlineKeyboardButton(texts("field_phone"), callback_data="edit_phone")],
+        [InlineKeyboardButton(texts("field_time"), callback_data="edit_time"), InlineKeyboardButton(texts("field_address"), callback_data="edit_address")],
+        [InlineKeyboardButton(texts("field_format"), callback_data="edit_format"), InlineKeyboardButton(texts("field_comment"), callback_data="edit_comment")],
+        [InlineKeyboardButton(texts("edit_back"), callback_data="back_to_confirm")]
+    ])
+
+
+@lru_cache(maxsize=None)
+def contact_keyboard(texts: Locale) -> ReplyKeyboardMarkup:
+    contact_button = KeyboardButton(texts("share_phone_button"), request_contact=True)
+    return ReplyKeyboardMarkup([[contact_button]], one_time_keyboard=True, resize_keyboard=True)
+
+
+# Текстовые поля, доступные для редактирования; подсказки к ним — ключи edit_prompt_<поле> в локалях
+EDIT_FIELDS = ("name", "phone", "address", "comment")
+
+
+# Подпись окна записи на нужном языке; окна на экране повторяются, поэтому подписи кэшируем
+@lru_cache(maxsize=4096)
+def slot_label(texts: Locale, schedule: Schedule, start: int) -> str:
+    begin = datetime.fromtimestamp(start, schedule.tz)
+    return texts("slot_label", weekday=texts.list("weekdays")[begin.weekday()], start=begin, end=begin + schedule.step)
+
+
+# Черновик заявки пользователя; создаётся на первом шаге записи или при выборе формата из меню.
+# Каждый шаг продлевает жизнь черновика — брошенные удаляет sweep_drafts_job
+def current_draft(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Draft:
+    draft = get_draft(context.user_data)
+    if draft is None:
+        user = update.effective_user
+        draft = context.user_data[DRAFT_KEY] = Draft(user.language_code if user else None)
+    else:
+        draft.touch()
+    return draft
+
+
+# Поля заявки одним блоком — общий шаблон для сводки пользователю и сообщения администратору
+def lead_fields(texts: Locale, context: ContextTypes.DEFAULT_TYPE) -> str:
+    draft = get_draft(context.user_data)
+    if draft.slot_start is not None:
+        time_text = slot_label(texts, context.bot_data["slots"].schedule, draft.slot_start)
+    else:
+        time_text = draft.time
+    comment = draft.comment or ''
+    return texts.render("lead_fields", {
+        "name": draft.name,
+        "phone": draft.phone,
+        "time": time_text,
+        "address": draft.address,
+        "format_label": draft.format_label,
+        "format_price": draft.format_price,
+        # Если комментария нет, указываем "нет"
+        "comment": comment if comment.strip() else texts("no_comment"),
+    })
+
+
+# Вспомогательная функция для формирования сводки заявки из черновика
+def compose_summary(context: ContextTypes.DEFAULT_TYPE, texts: Locale, key: str = "summary_check") -> str:
+    return texts.render(key, {"fields": lead_fields(texts, context)})
+
+
+# Сообщение дайджеста из нескольких заявок (заголовок — на языке администратора)
+def compose_digest(items: List[str]) -> str:
+    return admin_texts()("admin_digest", count=len(items), leads="\n\n".join(items))
+
+
+# Отчёт /stats из агрегатов воронки: (шаг, формат) -> [entered, transitions, revenue]
+def compose_stats(texts: Locale, totals: dict, days: int, since: date) -> str:
+    entered = dict.fromkeys(STEPS, 0)
+    transitions = dict.fromkeys(STEPS, 0)
+    for (step, _), counters in totals.items():
+        if step in entered:
+            entered[step] += counters[0]
+            transitions[step] += counters[1]
+    started = entered["START"]
+    if not started and not entered["SUBMITTED"]:
+        return texts("stats_empty", days=days)
+    labels = dict(zip(STEPS, texts.list("stats_steps")))
+    lines = [texts("stats_header", days=days, since=since), texts("stats_started", step=labels["START"], count=started)]
+    previous = started
+    for step in MAIN_PATH[1:]:
+        count = entered[step]
+        lines.append(texts(
+            "stats_step",
+            step=labels[step],
+            count=count,
+            share=count / started * 100 if started else 0,
+            # Отвал относительно предыдущего шага; записи, начатые до периода, могут дать отрицательное значение
+            drop=max(0, previous - count) / previous * 100 if previous else 0,
+        ))
+        previous = count
+    lines.append(texts("stats_conversion", rate=entered["SUBMITTED"] / started * 100 if started else 0))
+    lines.append(texts("stats_outcomes", cancelled=entered["CANCELLED"], expired=entered["EXPIRED"]))
+    lines.append(texts("stats_edits", signups=entered["CHOOSE_FIELD"], edits=transitions["CHOOSE_FIELD"]))
+    revenue_rows = sorted(
+        ((format_code, counters) for (step, format_code), counters in totals.items() if step == "SUBMITTED"),
+        key=lambda item: -item[1][2],
+    )
+    if revenue_rows:
+        catalog = get_catalog()
+        lines.append(texts("stats_revenue_header"))
+        for format_code, counters in revenue_rows:
+            option = catalog.get(f"format_{format_code}")
+            lines.append(texts(
+                "stats_revenue_row",
+                format=option.label if option else format_code or "?",
+                count=counters[1],
+                revenue=format_price(counters[2]),
+            ))
+        lines.append(texts("stats_revenue_total", revenue=format_price(sum(counters[2] for _, counters in revenue_rows))))
+    return "\n".join(lines)
+
+
+# Сохраняем выбранный формат в черновике
+def save_format(draft: Draft, option: FormatOption) -> None:
+    draft.format_code = option.code
+    draft.format_label = option.label
+    draft.format_price = option.price_label
+
+
+# Проверка, что команда пришла из админского чата
+def is_admin_chat(update: Update) -> bool:
+    admin_chat_id = os.getenv("ADMIN_CHAT_ID")
+    return bool(admin_chat_id) and str(update.effective_chat.id) == admin_chat_id
+
+
+# Запоминаем пользователя для рассылок; в группах бот объявления не рассылает
+async def remember_subscriber(update: Update, context: ContextTypes.DEFAULT_TYPE, source: str) -> None:
+    user, chat = update.effective_user, update.effective_chat
+    if user is not None and chat is not None and chat.type == "private":
+        await asyncio.to_thread(context.bot_data["subscribers"].add, user.id, chat.id, user.language_code, source)
+
+
+# Отчёт о ходе рассылки для админского чата
+def describe_broadcast(progress: BroadcastProgress) -> str:
+    admin = admin_texts()
+    return admin(
+        "broadcast_progress",
+        id=progress.id,
+        status=admin(f"broadcast_status_{progress.status}"),
+        total=progress.total,
+        sent=progress.sent,
+        failed=progress.failed,
+        blocked=progress.blocked,
+    )
+
+
+# Текст оповещения об ошибке: первое появление — с трейсбеком, повторы — одной строкой со счётчиком
+def describe_incident(incident: Incident, window: float) -> str:
+    admin = admin_texts()
+    if incident.reported_at is None:
+        return admin("alert_new", title=incident.title, where=incident.where, context=incident.context, details=incident.details)
+    return admin(
+        "alert_repeated",
+        title=incident.title,
+        where=incident.where,
+        context=incident.context,
+        count=incident.unreported,
+        minutes=max(1, round(window / 60)),
+        total=incident.total,
+        first_seen=datetime.fromtimestamp(incident.first_seen),
     )
-    return summary_text
+
+
+# Защита от флуда: лишние апдейты пользователя отбрасываются до всех остальных обработчиков
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = update.effective_user
+    if user is None or context.bot_data["flood_control"].allow(user.id):
+        return
+    THROTTLED_UPDATES.inc("callback_query" if update.callback_query else "message")
+    raise ApplicationHandlerStop
+
+
+# Уведомление администратора о заявке: сразу через outbox или в дайджест (ADMIN_DIGEST_SIZE > 0).
+# Срочные заявки — сессия в ближайшие ADMIN_DIGEST_URGENT_HOURS часов — дайджест не ждут
+async def notify_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: str, lead_text: str, slot_start: int = None) -> None:
+    digest = context.bot_data.get("digest")
+    urgent = digest is not None and slot_start is not None and slot_start - time.time() < digest.urgent_within
+    if digest is None or urgent:
+        await asyncio.to_thread(context.bot_data["outbox"].enqueue, chat_id, admin_texts()("admin_new_lead", lead=lead_text))
+        return
+    pending = await asyncio.to_thread(digest.add, chat_id, lead_text)
+    if pending >= digest.max_items:
+        context.job_queue.run_once(flush_digest_job, 0)
+    elif pending == 1:
+        # Первая заявка в пустом дайджесте запускает отсчёт максимальной задержки
+        context.job_queue.run_once(flush_digest_job, digest.max_delay, name=DIGEST_TIMER_JOB)
+
+
+# Задача JobQueue на каждом воркере: у накопленных заявок должен быть таймер максимальной задержки.
+# Его ставит воркер, получивший первую заявку; если этот воркер убрали или перезапустили,
+# таймер на тот же срок поставит любой другой. Первый запуск — сразу после старта, для заявок, накопленных до рестарта
+async def watch_digest_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if context.job_queue.get_jobs_by_name(DIGEST_TIMER_JOB):
+        return
+    digest = context.bot_data["digest"]
+    oldest = await asyncio.to_thread(digest.oldest_created_at)
+    if oldest is not None:
+        delay = max(0.0, oldest + digest.max_delay - time.time())
+        context.job_queue.run_once(flush_digest_job, delay, name=DIGEST_TIMER_JOB)
+
+
+# Задача JobQueue: склеить накопленные заявки и поставить дайджест в outbox
+async def flush_digest_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    for job in context.job_queue.get_jobs_by_name(DIGEST_TIMER_JOB):
+        job.schedule_removal()
+    flushed = await asyncio.to_thread(context.bot_data["digest"].flush, context.bot_data["outbox"])
+    if flushed:
+        logging.info(f"Admin digest with {flushed} leads queued")
+
+
+# Задача JobQueue: чистка user_data. Записи без черновика и вне диалога удаляются сразу — после /start и справки
+# в памяти и в persistence ничего не остаётся. Черновик, не менявшийся DRAFT_TTL_HOURS часов, удаляется вместе
+# с состоянием диалога; если задан DRAFT_REMINDER_HOURS, до этого пользователю один раз приходит напоминание
+async def sweep_drafts_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    application = context.application
+    settings = context.job.data
+    conversations = settings["conversation"]._conversations
+    # Ключ диалога — (chat_id, user_id); у ConversationHandler нет публичного доступа к диалогам, как и в метриках
+    conversation_keys = {}
+    for key in list(conversations):
+        conversation_keys.setdefault(key[-1], set()).add(key)
+
+    async def sweep_user(user_id: int) -> Optional[str]:
+        # Выполняется в полосе пользователя; у воркеров сначала сверяется версия в общем хранилище,
+        # чтобы не напоминать и не удалять по копии пользователя, который уже переехал на другой воркер
+        if not await application.refresh_user_state(user_id):
+            return None
+        user_data = application.user_data.get(user_id)
+        if user_data is None:
+            return None
+        draft = get_draft(user_data)
+        # Снимок ключей мог устареть, пока шла чистка предыдущих пользователей; личный чат — (user_id, user_id)
+        keys = [key for key in conversation_keys.get(user_id, set()) | {(user_id, user_id)} if key in conversations]
+        if draft is None and not keys:
+            application.drop_user_data(user_id)
+            return None
+        idle = time.time() - draft.updated_at if draft is not None else settings["ttl"]
+        if idle >= settings["ttl"]:
+            # Брошенной считается только начатая запись, а не выбор формата из меню
+            if reached(draft, "START"):
+                context.bot_data["funnel"].record("EXPIRED", draft)
+            for key in keys:
+                conversations.pop(key, None)
+            application.drop_user_data(user_id)
+            return "expired"
+        if settings["remind_after"] and keys and not draft.reminded and idle >= settings["remind_after"]:
+            draft.reminded = True
+            application.mark_user_changed(user_id)
+            return draft.language or DEFAULT_LANGUAGE
+        return None
+
+    expired = reminded = 0
+    for user_id in list(application.user_data):
+        # Пользователя, чьи апдейты сейчас обрабатываются, не трогаем — черновик меняется прямо сейчас
+        if application.is_busy(user_id):
+            continue
+        outcome = await application.run_in_lane(user_id, lambda: sweep_user(user_id))
+        if outcome == "expired":
+            expired += 1
+        elif outcome is not None:
+            # Напоминание отправляем уже вне полосы, чтобы не задерживать апдейты пользователя
+            try:
+                await context.bot.send_message(user_id, get_templates().get(outcome)("draft_reminder"))
+            except TelegramError as e:
+                logging.warning(f"Failed to remind {user_id} about the draft: {e}")
+            reminded += 1
+            # Напоминания идут с паузой, чтобы не упираться в лимит Bot API вместе с основным трафиком
+            await asyncio.sleep(DRAFT_REMINDER_PAUSE)
+    if expired or reminded:
+        logging.info(f"Drafts sweep: {expired} expired, {reminded} reminded")
+
+
+# Показ очередного шага. В режиме «живого сообщения» (LIVING_MESSAGE=1) бот редактирует одно своё сообщение
+# вместо отправки нового; ReplyKeyboard так показать нельзя — для неё сообщение всё равно отправляется
+async def show_step(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None) -> None:
+    living = context.bot_data.get("living_message")
+    if living and not isinstance(reply_markup, (ReplyKeyboardMarkup, ReplyKeyboardRemove)):
+        query = update.callback_query
+        message_id = query.message.message_id if query and query.message else context.user_data.get('ui_message_id')
+        if message_id:
+            try:
+                await context.bot.edit_message_text(
+                    text, chat_id=update.effective_chat.id, message_id=message_id, reply_markup=reply_markup
+                )
+                context.user_data['ui_message_id'] = message_id
+                return
+            except BadRequest as e:
+                # Сообщение удалено или не изменилось — отправляем новое
+                logging.info(f"Cannot edit living message {message_id}: {e}")
+    message = await update.effective_message.reply_text(text, reply_markup=reply_markup)
+    if living:
+        context.user_data['ui_message_id'] = message.message_id
+
+
+# Отметка выбора на нажатой кнопке и следующий шаг; в режиме «живого сообщения» — одним редактированием
+async def show_choice(update: Update, context: ContextTypes.DEFAULT_TYPE, selected_text: str, next_text: str, next_markup=None) -> None:
+    if context.bot_data.get("living_message"):
+        await show_step(update, context, f"{selected_text}\n\n{next_text}", next_markup)
+    else:
+        query = update.callback_query
+        await query.edit_message_text(selected_text)
+        await query.message.reply_text(next_text, reply_markup=next_markup)
+
+
+# Показываем свободные окна кнопками; если окон нет, время принимаем текстом и согласует администратор.
+# prefix — ключ текста, который показывается перед вопросом (например, "slot_taken")
+async def ask_time(update: Update, context: ContextTypes.DEFAULT_TYPE, prefix: str = None) -> int:
+    texts = texts_for(update)
+    slots = context.bot_data["slots"]
+    keyboard = slots.keyboard(lambda slot: slot_label(texts, slots.schedule, slot.start))
+    text = texts("ask_time_free_text" if keyboard is None else "ask_time")
+    await show_step(update, context, texts(prefix) + text if prefix else text, keyboard)
+    return TIME
 
 
 # Команда для получения chat_id
 async def debug_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    await update.message.reply_text(f"Chat ID: {chat_id}")
+    await update.message.reply_text(texts_for(update)("chat_id", chat_id=chat_id))
 
 
 # Команда /start — приветствие и главное меню
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    intro_text = (
-        "Добро пожаловать в XENON PRIVE.\n"
-        "Это цифровой сервис для индивидуальных ксеноновых ингаляций."
-    )
-    # Кнопки основного меню (InlineKeyboard)
-    keyboard = [
-        [InlineKeyboardButton(" О XENON PRIVE", callback_data="about")],
-        [InlineKeyboardButton(" Что даёт ингаляция", callback_data="benefits")],
-        [InlineKeyboardButton(" Выбрать формат", callback_data="choose_format")],
-        [InlineKeyboardButton(" Записаться", callback_data="signup")],
-        [InlineKeyboardButton(" Канал", url="https://t.me/xenonprive")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(intro_text, reply_markup=reply_markup)
+    await remember_subscriber(update, context, "start")
+    texts = texts_for(update)
+    await update.message.reply_text(texts("intro"), reply_markup=main_menu_keyboard(texts))
 
 # Обработчик пункта меню "О XENON PRIVE"
 async def about_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    about_text = (
-        "XENON PRIVE — премиальный сервис индивидуальных ксеноновых ингаляций (40% ксенона / 60% кислорода). "
-        "Каждая сессия направлена на глубокую релаксацию, снятие стресса и улучшение эмоционального состояния. "
-        "Ингаляции проводятся квалифицированным специалистом в комфортной обстановке. "
-        "Совмещая современные технологии и персональный подход, XENON PRIVE помогает вам обрести внутреннее спокойствие и равновесие."
-    )
     # Отправляем отдельным сообщением, чтобы меню осталось доступно
-    await query.message.reply_text(about_text)
+    await query.message.reply_text(texts_for(update)("about"))
 
 # Обработчик пункта меню "Что даёт ингаляция"
 async def benefits_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    benefits_text = (
-        "Что дают ксеноновые ингаляции:\n"
-        "• Глубокое расслабление и снижение уровня стресса.\n"
-        "• Снятие тревожности, улучшение настроения и эмоционального состояния.\n"
-        "• Обезболивающее действие, снижение мышечного напряжения.\n"
-        "• Улучшение качества сна и общее восстановление организма.\n"
-        "• Комфортная и безопасная неинвазивная процедура."
-    )
-    await query.message.reply_text(benefits_text)
+    await query.message.reply_text(texts_for(update)("benefits"))
 
 # Обработчик пункта меню "Выбрать формат"
 async def choose_format(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    # Кнопки с вариантами форматов (количество сессий и цена)
-    formats = [
-        ("1 сессия — 40 000 ₽", "format_1"),
-        ("3 сессии — 105 000 ₽", "format_3"),
-        ("5 сессий — 160 000 ₽", "format_5"),
-        ("8 сессий — 240 000 ₽", "format_8"),
-        ("10 сессий — 270 000 ₽", "format_10")
-    ]
-    keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in formats]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.message.reply_text("Выберите формат программы:", reply_markup=reply_markup)
+    # Кнопки с вариантами форматов (количество сессий и цена) берём из каталога
+    await show_step(update, context, texts_for(update)("choose_format"), get_catalog().keyboard)
 
 # Обработчик выбора формата из главного меню (сохраняет выбор)
 async def format_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    data = query.data  # например, "format_3"
-    sessions_number = data.split('_')[1]  # извлекаем число сессий
-    mapping = {
-        "1": ("1 сессия", "40 000 ₽"),
-        "3": ("3 сессии", "105 000 ₽"),
-        "5": ("5 сессий", "160 000 ₽"),
-        "8": ("8 сессий", "240 000 ₽"),
-        "10": ("10 сессий", "270 000 ₽")
-    }
-    label, price = mapping.get(sessions_number, (f"{sessions_number} сессий", ""))
-    # Сохраняем выбор в user_data
-    context.user_data['format_label'] = label
-    context.user_data['format_price'] = price
+    texts = texts_for(update)
+    option = get_catalog().get(query.data)  # например, "format_3"
+    if option is None:
+        # Кнопка от старого каталога (цены обновились) — показываем актуальные варианты
+        await query.edit_message_text(texts("format_unavailable"), reply_markup=get_catalog().keyboard)
+        return
+    # Сохраняем выбор в черновике заявки
+    save_format(current_draft(update, context), option)
     # Обновляем сообщение с вариантами, отмечая выбор, и уведомляем пользователя
-    await query.edit_message_text(f"Выбран формат: {label} — {price}")
-    await query.message.reply_text("Формат сохранён. Теперь вы можете записаться на сессию через меню 📝 Записаться.")
+    selected_text = texts("format_selected", format=option.button_text)
+    saved_text = texts("format_saved")
+    if context.bot_data.get("living_message"):
+        # Одно редактирование вместо двух вызовов; возвращаем меню, чтобы можно было сразу записаться
+        await show_step(update, context, f"{selected_text}\n{saved_text}", main_menu_keyboard(texts))
+    else:
+        await query.edit_message_text(selected_text)
+        await query.message.reply_text(saved_text)
 
 # Стартовая точка диалога записи (нажатие "Записаться")
 async def start_signup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    current_draft(update, context)
     query = update.callback_query
     await query.answer()
     # Спрашиваем имя
-    await query.message.reply_text("Как Вас зовут?")
+    await show_step(update, context, texts_for(update)("ask_name"))
     return NAME
 
 # Шаг 1: получаем имя пользователя
 async def name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     name = update.message.text.strip()
-    context.user_data['name'] = name
+    current_draft(update, context).name = name
     # Спрашиваем телефон. Предлагаем кнопку для отправки контакта
-    contact_button = KeyboardButton("📱 Отправить номер телефона", request_contact=True)
-    reply_markup = ReplyKeyboardMarkup([[contact_button]], one_time_keyboard=True, resize_keyboard=True)
-    await update.message.reply_text("Укажите, пожалуйста, Ваш номер телефона.", reply_markup=reply_markup)
+    texts = texts_for(update)
+    await show_step(update, context, texts("ask_phone"), contact_keyboard(texts))
     return PHONE
 
 # Шаг 2: получаем телефон (текстом или контактом)
@@ -164,157 +494,163 @@ async def phone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         phone = update.message.contact.phone_number
     else:
         phone = update.message.text.strip()
-    context.user_data['phone'] = phone
+    current_draft(update, context).phone = phone
+    # Одним сообщением нельзя и убрать кнопку контакта, и показать инлайн-кнопки окон, поэтому их два
+    await show_step(update, context, texts_for(update)("phone_received", phone=phone), ReplyKeyboardRemove())
     # Спрашиваем удобное время
-    await update.message.reply_text(
-        "Когда Вам удобно пройти сессию? Укажите дату и время.",
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return TIME
+    return await ask_time(update, context)
+
+# Шаг 3: выбор свободного окна
+async def time_slot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    slots = context.bot_data["slots"]
+    slot = slots.find_free(int(query.data.split('_')[1]))
+    if slot is None:
+        # Окно успели занять, или оно уже прошло — показываем актуальные
+        return await ask_time(update, context, prefix="slot_unavailable")
+    texts = texts_for(update)
+    draft = current_draft(update, context)
+    # В хранилище заявок время пишется на языке администратора, пользователю показывается на его языке
+    draft.time = slot_label(admin_texts(), slots.schedule, slot.start)
+    draft.slot_start = slot.start
+    selected_text = texts("time_selected", time=slot_label(texts, slots.schedule, slot.start))
+    if draft.editing_field == 'time':
+        draft.editing_field = None
+        await show_choice(update, context, selected_text, compose_summary(context, texts, "summary_updated"), confirm_keyboard(texts))
+        return CONFIRM
+    # Спрашиваем адрес или район
+    await show_choice(update, context, selected_text, texts("ask_address"))
+    return ADDRESS
 
-# Шаг 3: получаем удобное время
+# Шаг 3 без свободных окон: удобное время текстом
 async def time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    preferred_time = update.message.text.strip()
-    context.user_data['time'] = preferred_time
+    if context.bot_data["slots"].free_slots(1):
+        # Окна есть — время выбирается только кнопкой
+        return await ask_time(update, context)
+    texts = texts_for(update)
+    draft = current_draft(update, context)
+    draft.time = update.message.text.strip()
+    draft.slot_start = None
+    if draft.editing_field == 'time':
+        draft.editing_field = None
+        await show_step(update, context, compose_summary(context, texts, "summary_updated"), confirm_keyboard(texts))
+        return CONFIRM
     # Спрашиваем адрес или район
-    await update.message.reply_text("Укажите адрес или район, где будет проходить сессия.")
+    await show_step(update, context, texts("ask_address"))
     return ADDRESS
 
 # Шаг 4: получаем адрес
 async def address_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    address = update.message.text.strip()
-    context.user_data['address'] = address
+    draft = current_draft(update, context)
+    draft.address = update.message.text.strip()
+    texts = texts_for(update)
     # Если формат уже был выбран ранее через меню, пропускаем вопрос о формате
-    if 'format_label' in context.user_data and 'format_price' in context.user_data:
+    if draft.has_format():
         # Переходим сразу к вопросу о комментарии
-        await update.message.reply_text(
-            "Если у Вас есть дополнительные комментарии или вопросы, вы можете написать их ниже.\n"
-            "Если комментариев нет, отправьте /skip."
-        )
+        await show_step(update, context, texts("ask_comment"))
         return COMMENT
     else:
         # Спрашиваем формат сессий, показываем клавиатуру с вариантами
-        formats = [
-            ("1 сессия — 40 000 ₽", "format_1"),
-            ("3 сессии — 105 000 ₽", "format_3"),
-            ("5 сессий — 160 000 ₽", "format_5"),
-            ("8 сессий — 240 000 ₽", "format_8"),
-            ("10 сессий — 270 000 ₽", "format_10")
-        ]
-        keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in formats]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Выберите формат программы:", reply_markup=reply_markup)
+        await show_step(update, context, texts("choose_format"), get_catalog().keyboard)
         return FORMAT_STATE
 
 # Шаг 5: обработчик выбора формата в процессе диалога
 async def format_handler_conv(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    data = query.data  # например, "format_5"
-    sessions_number = data.split('_')[1]
-    mapping = {
-        "1": ("1 сессия", "40 000 ₽"),
-        "3": ("3 сессии", "105 000 ₽"),
-        "5": ("5 сессий", "160 000 ₽"),
-        "8": ("8 сессий", "240 000 ₽"),
-        "10": ("10 сессий", "270 000 ₽")
-    }
-    label, price = mapping.get(sessions_number, (f"{sessions_number} сессий", ""))
-    context.user_data['format_label'] = label
-    context.user_data['format_price'] = price
-    # Обновляем сообщение с вариантами формата, указывая выбранный вариант
-    await query.edit_message_text(f"Выбран формат: {label} — {price}")
-    if context.user_data.get('editing_field') == 'format':
+    texts = texts_for(update)
+    option = get_catalog().get(query.data)  # например, "format_5"
+    if option is None:
+        await query.edit_message_text(texts("format_unavailable"), reply_markup=get_catalog().keyboard)
+        return FORMAT_STATE
+    draft = current_draft(update, context)
+    save_format(draft, option)
+    if draft.editing_field == 'format':
         # Если выбор формата произошёл в режиме редактирования данных
-        context.user_data['editing_field'] = None  # сбрасываем флаг редактирования
+        draft.editing_field = None  # сбрасываем флаг редактирования
         # Формируем обновлённую сводку и возвращаемся к этапу подтверждения
-        summary_text = compose_summary(context.user_data, prefix="Обновленные данные:\n")
-        keyboard = [
-            [InlineKeyboardButton("✅ Отправить заявку", callback_data="confirm_send")],
-            [InlineKeyboardButton("✏️ Изменить данные", callback_data="edit_data")]
-        ]
-        await query.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard))
-        return CONFIRM
+        next_text = compose_summary(context, texts, "summary_updated")
+        next_markup, next_state = confirm_keyboard(texts), CONFIRM
     else:
         # Переходим к вопросу о комментарии
-        await query.message.reply_text(
-            "Если у Вас есть дополнительные комментарии или вопросы, вы можете написать их ниже.\n"
-            "Если комментариев нет, отправьте команду /skip."
-        )
-        return COMMENT
+        next_text = texts("ask_comment")
+        next_markup, next_state = None, COMMENT
+    # Обновляем сообщение с вариантами формата, указывая выбранный вариант
+    await show_choice(update, context, texts("format_selected", format=option.button_text), next_text, next_markup)
+    return next_state
 
 # Шаг 6: получаем комментарий (либо команда /skip для пропуска)
 async def comment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text.strip()
     # Если пользователь написал "нет" или аналогичное - считаем, что комментария нет
     if text.lower() in ["нет", "не", "no", "none"]:
-        context.user_data['comment'] = ""
+        current_draft(update, context).comment = ""
     else:
-        context.user_data['comment'] = text
+        current_draft(update, context).comment = text
     # Формируем сводку введённых данных и предлагаем подтвердить или отредактировать
-    summary_text = compose_summary(context.user_data)
-    keyboard = [
-        [InlineKeyboardButton("✅ Отправить заявку", callback_data="confirm_send")],
-        [InlineKeyboardButton("✏️ Изменить данные", callback_data="edit_data")]
-    ]
-    await update.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard))
+    texts = texts_for(update)
+    await show_step(update, context, compose_summary(context, texts), confirm_keyboard(texts))
     return CONFIRM
 
 # Обработчик команды /skip (пропустить комментарий)
 async def skip_comment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Пользователь выбрал пропустить комментарий
-    context.user_data['comment'] = ""
-    summary_text = compose_summary(context.user_data)
-    keyboard = [
-        [InlineKeyboardButton("✅ Отправить заявку", callback_data="confirm_send")],
-        [InlineKeyboardButton("✏️ Изменить данные", callback_data="edit_data")]
-    ]
-    await update.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard))
+    current_draft(update, context).comment = ""
+    texts = texts_for(update)
+    await show_step(update, context, compose_summary(context, texts), confirm_keyboard(texts))
     return CONFIRM
 
 # Шаг 7: подтверждение заявки (пользователь нажал "Отправить заявку")
 async def confirm_send_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    # Собираем данные заявки
-    name = context.user_data.get('name')
-    phone = context.user_data.get('phone')
-    time = context.user_data.get('time')
-    address = context.user_data.get('address')
-    format_label = context.user_data.get('format_label')
-    format_price = context.user_data.get('format_price')
-    comment = context.user_data.get('comment') or "(нет)"
-    # Информация о пользователе (Telegram)
     user = query.from_user
+    texts = texts_for(update)
+    leads = context.bot_data["leads"]
+    # Повторное нажатие или повторная запись за короткое время — заявка уже есть
+    duplicate_window = float(os.getenv("DUPLICATE_WINDOW_MINUTES", 30)) * 60
+    # ReplyKeyboard убрана ещё на шаге телефона; в режиме «живого сообщения» просто редактируем его
+    final_markup = None if context.bot_data.get("living_message") else ReplyKeyboardRemove()
+    draft = get_draft(context.user_data)
+    if draft is None or not draft.is_complete():
+        # Черновик удалён как брошенный (или данные потеряны) — отправлять нечего, запись начинается заново
+        await show_step(update, context, texts("draft_expired"), final_markup)
+        context.user_data.clear()
+        return ConversationHandler.END
+    if await asyncio.to_thread(leads.find_duplicate, user.id, draft.phone, duplicate_window):
+        await show_step(update, context, texts("duplicate_lead"), final_markup)
+        context.user_data.clear()
+        return ConversationHandler.END
+    # Бронируем окно атомарно: если его только что занял другой пользователь, предлагаем выбрать другое
+    slot_start = draft.slot_start
+    if slot_start is not None:
+        slots = context.bot_data["slots"]
+        slot = slots.schedule.slot_at(slot_start)
+        if slot is None or await slots.book(slot, user.id) is None:
+            draft.slot_start = None
+            draft.editing_field = 'time'
+            return await ask_time(update, context, prefix="slot_taken")
+    await asyncio.to_thread(leads.add, user.id, user.username, draft.to_dict())
+    # Выручка в воронке — по цене из текущего каталога (в заявке цена хранится только строкой)
+    option = get_catalog().get(f"format_{draft.format_code}")
+    context.bot_data["funnel"].record("SUBMITTED", draft, revenue=option.price if option else 0)
+    await remember_subscriber(update, context, "signup")
+    # Информация о пользователе (Telegram)
     username = user.username
     user_id = user.id
     user_info = f"@{username} (ID: {user_id})" if username else f"ID: {user_id}"
-    # Формируем текст для администратора (в указанный чат)
-    admin_message = (
-        "🔔 Новая заявка XENON PRIVE 🔔\n"
-        f"Имя: {name}\n"
-        f"Телефон: {phone}\n"
-        f"Удобное время: {time}\n"
-        f"Адрес: {address}\n"
-        f"Формат: {format_label} — {format_price}\n"
-        f"Комментарий: {comment}\n"
-        f"Пользователь Telegram: {user_info}"
-    )
-    # Отправляем заявку в админский чат
+    # Формируем текст для администратора (в указанный чат) по тому же шаблону полей, что и сводка
+    admin = admin_texts()
+    lead_text = admin("admin_lead", fields=lead_fields(admin, context), user=user_info)
+    # Ставим заявку в очередь: доставкой в админский чат занимается фоновый воркер
     admin_chat_id = os.getenv("ADMIN_CHAT_ID")
-    print(f"Admin chat ID: {admin_chat_id}")  # ← вставь сюда
-
     if admin_chat_id:
-        try:
-            admin_chat_id_int = int(admin_chat_id)
-        except ValueError:
-            admin_chat_id_int = admin_chat_id  # на случай, если chat_id не числовой
-        try:
-            await context.bot.send_message(chat_id=admin_chat_id_int, text=admin_message)
-        except Exception as e:
-            logging.error(f"Failed to send admin message: {e}")
+        await notify_admin(context, admin_chat_id, lead_text, slot_start)
+    else:
+        logging.error(f"ADMIN_CHAT_ID не задан, заявка не отправлена администратору: {lead_text}")
     # Сообщаем пользователю об успешной отправке
-    await query.message.reply_text("Спасибо! Ваша заявка принята. Мы свяжемся с вами в ближайшее время.", reply_markup=ReplyKeyboardRemove())
+    await show_step(update, context, texts("lead_accepted"), final_markup)
     # Очищаем сохранённые данные и завершаем диалог
     context.user_data.clear()
     return ConversationHandler.END
@@ -323,123 +659,300 @@ async def confirm_send_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 async def edit_data_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
+    texts = texts_for(update)
+    if context.bot_data.get("living_message"):
+        # Сводка остаётся на экране, кнопки подтверждения меняются на выбор поля
+        await show_step(update, context, compose_summary(context, texts, "summary_edit"), edit_fields_keyboard(texts))
+        return CHOOSE_FIELD
     # Убираем кнопки подтверждения/редактирования в сообщении со сводкой
     await query.edit_message_reply_markup(reply_markup=None)
     # Отправляем новое сообщение с выбором поля для редактирования
-    keyboard = [
-        [InlineKeyboardButton("Имя", callback_data="edit_name"), InlineKeyboardButton("Телефон", callback_data="edit_phone")],
-        [InlineKeyboardButton("Время", callback_data="edit_time"), InlineKeyboardButton("Адрес", callback_data="edit_address")],
-        [InlineKeyboardButton("Формат", callback_data="edit_format"), InlineKeyboardButton("Комментарий", callback_data="edit_comment")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_confirm")]
-    ]
-    await query.message.reply_text("Что вы хотите изменить?", reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.message.reply_text(texts("edit_choose"), reply_markup=edit_fields_keyboard(texts))
     return CHOOSE_FIELD
 
 # Обработчик выбора поля для редактирования
 async def choose_field_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
+    texts = texts_for(update)
     data = query.data  # например, "edit_phone" или "back_to_confirm"
     if data == "back_to_confirm":
         # Вернуться к подтверждению без изменений
-        summary_text = compose_summary(context.user_data)
-        keyboard = [
-            [InlineKeyboardButton("✅ Отправить заявку", callback_data="confirm_send")],
-            [InlineKeyboardButton("✏️ Изменить данные", callback_data="edit_data")]
-        ]
-        await query.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await show_step(update, context, compose_summary(context, texts), confirm_keyboard(texts))
         return CONFIRM
     # Иначе, выбрано конкретное поле для редактирования
     field = data.split('_')[1]  # получаем часть после "edit_"
-    context.user_data['editing_field'] = field
+    current_draft(update, context).editing_field = field
     if field == "format":
         # Редактирование формата: снова показываем варианты форматов
-        formats = [
-            ("1 сессия — 40 000 ₽", "format_1"),
-            ("3 сессии — 105 000 ₽", "format_3"),
-            ("5 сессий — 160 000 ₽", "format_5"),
-            ("8 сессий — 240 000 ₽", "format_8"),
-            ("10 сессий — 270 000 ₽", "format_10")
-        ]
-        keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in formats]
-        await query.message.reply_text("Выберите новый формат:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await show_step(update, context, texts("choose_new_format"), get_catalog().keyboard)
         return FORMAT_STATE
+    elif field == "time":
+        # Редактирование времени: снова показываем свободные окна
+        return await ask_time(update, context)
     else:
         # Редактирование текстового поля: запрашиваем новое значение
-        if field == "name":
-            prompt = "Введите новое имя:"
-        elif field == "phone":
-            prompt = "Введите новый номер телефона:"
-        elif field == "time":
-            prompt = "Укажите новое удобное время:"
-        elif field == "address":
-            prompt = "Укажите новый адрес или район:"
-        elif field == "comment":
-            prompt = "Введите новый комментарий (или оставьте пустым):"
-        else:
-            prompt = "Введите новое значение:"
-        await query.message.reply_text(prompt)
+        await show_step(update, context, texts(f"edit_prompt_{field}" if field in EDIT_FIELDS else "edit_prompt_default"))
         return NEW_VALUE
 
 # Обработчик ввода нового значения поля при редактировании
 async def new_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     new_text = update.message.text.strip()
-    field = context.user_data.get('editing_field')
+    draft = current_draft(update, context)
+    field = draft.editing_field
     if field:
-        # Обновляем соответствующее поле в сохранённых данных
-        if field == "name":
-            context.user_data['name'] = new_text
-        elif field == "phone":
-            context.user_data['phone'] = new_text
-        elif field == "time":
-            context.user_data['time'] = new_text
-        elif field == "address":
-            context.user_data['address'] = new_text
-        elif field == "comment":
-            context.user_data['comment'] = new_text
-        context.user_data['editing_field'] = None
+        # Обновляем соответствующее поле в черновике
+        if field in EDIT_FIELDS:
+            setattr(draft, field, new_text)
+        draft.editing_field = None
     # Отправляем обновлённую сводку данных для подтверждения
-    summary_text = compose_summary(context.user_data, prefix="Обновленные данные:\n")
-    keyboard = [
-        [InlineKeyboardButton("✅ Отправить заявку", callback_data="confirm_send")],
-        [InlineKeyboardButton("✏️ Изменить данные", callback_data="edit_data")]
-    ]
-    await update.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard))
+    texts = texts_for(update)
+    await show_step(update, context, compose_summary(context, texts, "summary_updated"), confirm_keyboard(texts))
     return CONFIRM
 
 # Обработчик команды /cancel для отмены диалога
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message:
-        await update.message.reply_text(
-            "Вы отменили запись. Если потребуется, вы можете начать заново командой /start.",
-            reply_markup=ReplyKeyboardRemove()
-        )
+        await update.message.reply_text(texts_for(update)("cancelled"), reply_markup=ReplyKeyboardRemove())
+    context.bot_data["funnel"].record("CANCELLED", get_draft(context.user_data))
     context.user_data.clear()
     return ConversationHandler.END
 
+# Команда /reload_formats — перечитать formats.json без передеплоя (только из админского чата)
+async def reload_formats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update):
+        return
+    admin = admin_texts()
+    try:
+        catalog = reload_catalog()
+    except Exception as e:
+        logging.error(f"Failed to reload formats: {e}")
+        await update.message.reply_text(admin("admin_formats_failed", error=e))
+        return
+    await context.application.catalog_reloaded()
+    lines = "\n".join(option.button_text for option in catalog.options)
+    await update.message.reply_text(admin("admin_formats_reloaded", formats=lines))
+
+# Команда /leads [N | id <ID пользователя> | <телефон>] — последние заявки из локального хранилища (только из админского чата)
+async def leads_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update):
+        return
+    admin = admin_texts()
+    leads = context.bot_data["leads"]
+    args = context.args or []
+    if not args:
+        rows = await asyncio.to_thread(leads.recent)
+    elif args[0] == "id" and len(args) > 1 and args[1].isdecimal():
+        rows = await asyncio.to_thread(leads.by_user, int(args[1]))
+    elif args[0].isdecimal() and len(args[0]) <= 3:
+        rows = await asyncio.to_thread(leads.recent, min(int(args[0]), LEADS_MAX_ROWS))
+    else:
+        rows = await asyncio.to_thread(leads.by_phone, " ".join(args))
+    if not rows:
+        await update.message.reply_text(admin("admin_no_leads"))
+        return
+    lines = []
+    for row in rows:
+        user_info = f"@{row['username']}" if row["username"] else f"ID: {row['user_id']}"
+        lines.append(admin(
+            "admin_lead_row",
+            id=row['id'],
+            created=datetime.fromtimestamp(row["created_at"]),
+            name=row['name'],
+            phone=row['phone'],
+            format=row['format_label'],
+            user=user_info,
+        ))
+    # Длинный список — несколькими сообщениями: лимит Telegram 4096 символов на сообщение
+    chunk: List[str] = []
+    length = 0
+    for line in lines:
+        if chunk and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            await update.message.reply_text("\n".join(chunk))
+            chunk, length = [], 0
+        chunk.append(line)
+        length += len(line) + 1
+    await update.message.reply_text("\n".join(chunk))
+
+# Команда /broadcast <текст> — объявление всем, кто запускал бота (только из админского чата).
+# Рассылка идёт в фоне; о ходе отправки бот сообщает, редактируя своё ответное сообщение
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update):
+        return
+    admin = admin_texts()
+    parts = update.message.text.split(None, 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text(admin("broadcast_usage"))
+        return
+    broadcaster = context.bot_data["broadcaster"]
+    progress = await asyncio.to_thread(broadcaster.create, parts[1].strip(), update.effective_chat.id)
+    if progress is None:
+        running = await asyncio.to_thread(broadcaster.running)
+        await update.message.reply_text(admin("broadcast_busy", id=running.id if running else "?"))
+        return
+    report = await update.message.reply_text(describe_broadcast(progress))
+    await asyncio.to_thread(broadcaster.set_report_message, progress.id, report.message_id)
+
+# Команда /broadcast_stop — остановить текущую рассылку (только из админского чата)
+async def broadcast_stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update):
+        return
+    admin = admin_texts()
+    broadcast_id = await asyncio.to_thread(context.bot_data["broadcaster"].stop_running)
+    if broadcast_id is None:
+        await update.message.reply_text(admin("broadcast_not_running"))
+    else:
+        await update.message.reply_text(admin("broadcast_stopped", id=broadcast_id))
+
+# Команда /stats [дней] — воронка записи, отвал по шагам и выручка по форматам (только из админского чата)
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin_chat(update):
+        return
+    args = context.args or []
+    days = min(int(args[0]), STATS_MAX_DAYS) if args and args[0].isdecimal() and int(args[0]) > 0 else STATS_DEFAULT_DAYS
+    funnel = context.bot_data["funnel"]
+    since = date.fromisoformat(funnel.day()) - timedelta(days=days - 1)
+    await update.message.reply_text(compose_stats(admin_texts(), await funnel.totals(since), days, since))
+
 # Обработчик /cancel вне диалога (общий)
 async def cancel_command_global(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("Активной записи нет.", reply_markup=ReplyKeyboardRemove())
+    await update.message.reply_text(texts_for(update)("no_active_signup"), reply_markup=ReplyKeyboardRemove())
 
-# Главная функция запуска бота
-def main() -> None:
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        logging.error("BOT_TOKEN не задан. Поместите токен вашего бота в переменную окружения BOT_TOKEN.")
-        return
-    # Создаем приложение бота
-    application = Application.builder().token(token).build()
+# Глобальный обработчик ошибок (апдейты и задачи JobQueue): пишем в лог и передаём в оповещения администратору.
+# Сам обработчик ничего не отправляет — сообщения уходят из фоновой задачи ErrorAlerts через outbox
+async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    error = context.error
+    if isinstance(update, Update):
+        user = update.effective_user
+        where = f"update {update.update_id}" + (f", user {user.id}" if user else "")
+    else:
+        where = "job" if context.job is not None else "—"
+    logging.error(f"Error while handling {where}: {error!r}", exc_info=error)
+    context.bot_data["alerts"].record(error, where)
 
-    # Регистрируем обработчики команд и событий
-    application.add_handler(CommandHandler("get_chat_id", debug_chat_id))
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("cancel", cancel_command_global))
-    application.add_handler(CallbackQueryHandler(about_info, pattern="^about$"))
-    application.add_handler(CallbackQueryHandler(benefits_info, pattern="^benefits$"))
-    application.add_handler(CallbackQueryHandler(choose_format, pattern="^choose_format$"))
-    # Глобальный обработчик выбора формата (работает вне режима диалога)
-    # block=False позволяет обработчику диалога перехватывать эти же callback, когда он активен
-    application.add_handler(CallbackQueryHandler(format_selection, pattern="^format_(1|3|5|8|10)$", block=False))
+
+# Запуск фоновых задач после инициализации бота
+async def post_init(application: Application) -> None:
+    application.bot_data["outbox"].start(application.bot)
+    # Рассылка, прерванная рестартом, продолжается с сохранённого курсора
+    application.bot_data["broadcaster"].start(application.bot)
+    application.bot_data["loop_monitor"].start()
+    application.bot_data["funnel"].start()
+    application.bot_data["alerts"].start()
+
+
+# Остановка фоновых задач после остановки Application
+async def post_stop(application: Application) -> None:
+    await application.bot_data["outbox"].stop()
+    await application.bot_data["broadcaster"].stop()
+    await application.bot_data["loop_monitor"].stop()
+    await application.bot_data["funnel"].stop()
+    await application.bot_data["alerts"].stop()
+
+
+# Сборка приложения со всеми обработчиками
+def build_application(
+    token: str,
+    webhook_mode: bool = False,
+    db_path: str = None,
+    base_url: str = None,
+    state_store: StateStore = None,
+    profile: StartupProfile = None,
+) -> Application:
+    db_path = db_path or database_path()
+    # Апдейты разных пользователей обрабатываются параллельно (до MAX_CONCURRENT_UPDATES одновременно),
+    # апдейты одного пользователя — строго по очереди
+    max_concurrent = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+    # Запросы к Bot API с замером задержки и счётчиком ошибок по методам
+    request = InstrumentedRequest(connection_pool_size=256)
+    builder = (
+        Application.builder()
+        .concurrent_updates(MAX_PENDING_TASKS)
+        .token(token)
+        .request(request)
+        .post_init(post_init)
+        .post_stop(post_stop)
+    )
+    if state_store is not None:
+        # Воркер за диспетчером: состояние пользователя синхронизируется с общим хранилищем вокруг каждого апдейта
+        builder = builder.application_class(ShardedApplication, {"max_concurrent": max_concurrent, "state_store": state_store})
+    else:
+        # Состояние диалога и user_data переживают рестарт: пишутся в SQLite пачками раз в PERSISTENCE_INTERVAL секунд
+        persistence = SQLitePersistence(
+            db_path,
+            update_interval=float(os.getenv("PERSISTENCE_INTERVAL", 10)),
+        )
+        builder = builder.application_class(OrderedApplication, {"max_concurrent": max_concurrent}).persistence(persistence)
+    if base_url:
+        # Другой адрес Bot API (локальный сервер, нагрузочный стенд)
+        builder = builder.base_url(base_url)
+    if webhook_mode:
+        # В режиме webhook апдейты приходят через наш HTTP-сервер, Updater не нужен. Отдельный клиент
+        # для getUpdates тоже: каждый клиент httpx при создании читает сертификаты, это десятки мс на старте
+        builder = builder.updater(None).get_updates_request(request)
+    application = builder.build()
+    if profile is not None:
+        profile.mark("builder")
+    # Каталог форматов и тексты загружаем при старте, чтобы ошибка в formats.json или в переводах была видна сразу
+    get_catalog()
+    get_templates()
+    application.bot_data["outbox"] = AdminOutbox(
+        db_path,
+        messages_per_minute=float(os.getenv("ADMIN_MESSAGES_PER_MINUTE", 20)),
+    )
+    # Ошибки склеиваются по отпечатку: о новой — сразу, о повторах — раз в ALERT_WINDOW секунд,
+    # всего не больше ALERT_MAX_PER_MINUTE сообщений в минуту
+    application.bot_data["alerts"] = ErrorAlerts(
+        application.bot_data["outbox"],
+        os.getenv("ADMIN_CHAT_ID"),
+        describe=describe_incident,
+        window=float(os.getenv("ALERT_WINDOW", 60)),
+        max_per_minute=float(os.getenv("ALERT_MAX_PER_MINUTE", 5)),
+    )
+    # ADMIN_DIGEST_SIZE > 0: заявки уходят администратору дайджестом из стольких заявок
+    # или через ADMIN_DIGEST_MAX_DELAY секунд после первой, смотря что наступит раньше
+    digest_size = int(os.getenv("ADMIN_DIGEST_SIZE", 0))
+    if digest_size > 0:
+        if application.job_queue is None:
+            raise RuntimeError('Digest mode needs the JobQueue: pip install "python-telegram-bot[job-queue]"')
+        application.bot_data["digest"] = AdminDigest(
+            db_path,
+            max_items=digest_size,
+            max_delay=float(os.getenv("ADMIN_DIGEST_MAX_DELAY", 300)),
+            urgent_within=float(os.getenv("ADMIN_DIGEST_URGENT_HOURS", 24)) * 3600,
+            compose=compose_digest,
+        )
+        application.job_queue.run_repeating(watch_digest_job, interval=DIGEST_WATCH_INTERVAL, first=0, name=DIGEST_WATCH_JOB)
+    else:
+        application.bot_data["digest"] = None
+    application.bot_data["leads"] = LeadStore(db_path)
+    # Подписчики для рассылок и сами рассылки; BROADCAST_RATE — сообщений в секунду с запасом до лимита Telegram (~30)
+    subscribers = SubscriberStore(db_path)
+    application.bot_data["subscribers"] = subscribers
+    application.bot_data["broadcaster"] = Broadcaster(
+        db_path,
+        subscribers,
+        rate=float(os.getenv("BROADCAST_RATE", 25)),
+        report_interval=float(os.getenv("BROADCAST_REPORT_INTERVAL", 10)),
+        describe=describe_broadcast,
+    )
+    # Расписание специалиста и брони; ошибка в schedule.json тоже видна сразу при старте
+    application.bot_data["slots"] = SlotBook(db_path, load_schedule(schedule_path()))
+    # Воронка записи: переходы копятся в памяти и раз в FUNNEL_FLUSH_INTERVAL секунд пишутся в дневные агрегаты
+    application.bot_data["funnel"] = FunnelStats(
+        db_path,
+        tz=application.bot_data["slots"].schedule.tz,
+        flush_interval=float(os.getenv("FUNNEL_FLUSH_INTERVAL", 10)),
+    )
+    application.bot_data["loop_monitor"] = LoopMonitor()
+    # LIVING_MESSAGE=1: шаги записи и редактирования показываются в одном редактируемом сообщении
+    application.bot_data["living_message"] = os.getenv("LIVING_MESSAGE", "0") == "1"
+
+    # FLOOD_RATE апдейтов в секунду на пользователя с запасом FLOOD_BURST; FLOOD_RATE=0 отключает ограничение
+    flood_rate = float(os.getenv("FLOOD_RATE", 2))
+    if flood_rate > 0:
+        application.bot_data["flood_control"] = FloodControl(flood_rate, float(os.getenv("FLOOD_BURST", 10)))
+        application.add_handler(TypeHandler(Update, flood_guard), group=-1)
 
     # Определяем диалог (ConversationHandler) для процесса записи
     conv_handler = ConversationHandler(
@@ -450,7 +963,10 @@ def main() -> None:
                 MessageHandler(filters.CONTACT, phone_handler),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, phone_handler)
             ],
-            TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, time_handler)],
+            TIME: [
+                CallbackQueryHandler(time_slot_handler, pattern=r"^slot_\d+$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, time_handler)
+            ],
             ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, address_handler)],
             FORMAT_STATE: [CallbackQueryHandler(format_handler_conv, pattern="^format_")],
             COMMENT: [
@@ -464,26 +980,255 @@ def main() -> None:
             NEW_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, new_value_handler)]
         },
         fallbacks=[CommandHandler("cancel", cancel), CommandHandler("skip", skip_comment_handler)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="signup",
+        # У воркеров за диспетчером диалоги хранит общее хранилище, а не BasePersistence
+        persistent=state_store is None
     )
+    # Диалог регистрируем первым: в группе срабатывает только один обработчик, и внутри записи
+    # выбор формата и /cancel должны попадать в диалог, а не в глобальные обработчики
     application.add_handler(conv_handler)
 
-    # Запуск бота (долгополлинг)
-    logging.info("Bot is starting polling...")
-    application.run_polling()
+    # Регистрируем обработчики команд и событий
+    application.add_handler(CommandHandler("get_chat_id", debug_chat_id))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("cancel", cancel_command_global))
+    application.add_handler(CommandHandler("reload_formats", reload_formats_command))
+    application.add_handler(CommandHandler("leads", leads_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("broadcast_stop", broadcast_stop_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CallbackQueryHandler(about_info, pattern="^about$"))
+    application.add_handler(CallbackQueryHandler(benefits_info, pattern="^benefits$"))
+    application.add_handler(CallbackQueryHandler(choose_format, pattern="^choose_format$"))
+    # Глобальный обработчик выбора формата (работает вне режима диалога). Диалог зарегистрирован раньше и сам
+    # перехватывает эти callback; обработчик блокирующий, чтобы выполняться в полосе пользователя
+    application.add_handler(CallbackQueryHandler(format_selection, pattern=r"^format_\w+$"))
+    application.add_error_handler(global_error_handler)
 
-if __name__ == "__main__":
-    main()
+    # Брошенные записи: раз в DRAFT_SWEEP_MINUTES минут удаляем черновики старше DRAFT_TTL_HOURS часов
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            sweep_drafts_job,
+            interval=float(os.getenv("DRAFT_SWEEP_MINUTES", 10)) * 60,
+            data={
+                "conversation": conv_handler,
+                "ttl": float(os.getenv("DRAFT_TTL_HOURS", 24)) * 3600,
+                "remind_after": float(os.getenv("DRAFT_REMINDER_HOURS", 0)) * 3600,
+            },
+            name=DRAFT_SWEEP_JOB,
+        )
+    else:
+        logging.warning('JobQueue is not available, abandoned drafts will not be evicted: pip install "python-telegram-bot[job-queue]"')
 
-from telegram.error import TelegramError
+    # Переходы диалога считаются в воронку; обёртка внутри замера времени, чтобы он включал и её
+    track_transitions(conv_handler, application.bot_data["funnel"], STATE_NAMES)
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers, STATE_NAMES)
+    register_gauges(application, conv_handler)
+    if profile is not None:
+        profile.mark("handler registration")
+    return application
 
-@application.error_handler
-async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    admin_id = os.getenv("ADMIN_CHAT_ID")
-    error_message = f"❗ Бот упал с ошибкой:\n{context.error}"
 
+# Метрики, значения которых снимаются в момент запроса /metrics
+def register_gauges(application: OrderedApplication, conv_handler: ConversationHandler) -> None:
+    REGISTRY.register(Gauge("xenon_update_queue_depth", "Updates waiting in the Application queue",
+                            lambda: application.update_queue.qsize()))
+    REGISTRY.register(Gauge("xenon_updates_in_flight", "Updates being processed right now",
+                            lambda: application.queue_stats()["in_flight"]))
+    REGISTRY.register(Gauge("xenon_updates_waiting", "Updates waiting for their user's lane or a free slot",
+                            lambda: application.queue_stats()["waiting"]))
+    # У ConversationHandler нет публичного доступа к текущим диалогам, читаем внутренний словарь
+    REGISTRY.register(Gauge("xenon_active_conversations", "Users in the middle of the signup dialog",
+                            lambda: len(conv_handler._conversations)))
+    REGISTRY.register(Gauge("xenon_flood_control_buckets", "Per-user rate-limit buckets in memory",
+                            lambda: len(application.bot_data.get("flood_control") or ())))
+    REGISTRY.register(Gauge("xenon_admin_outbox_pending", "Admin notifications waiting for delivery",
+                            lambda: application.bot_data["outbox"].pending_count()))
+    REGISTRY.register(Gauge("xenon_admin_digest_pending", "Leads collected for the next admin digest",
+                            lambda: application.bot_data["digest"].pending_count() if application.bot_data["digest"] else 0))
+    REGISTRY.register(Gauge("xenon_error_alerts_pending", "Error kinds with occurrences not yet reported to the admin",
+                            lambda: application.bot_data["alerts"].pending_count()))
+    REGISTRY.register(Gauge("xenon_funnel_pending", "Funnel counters waiting to be written to the database",
+                            lambda: application.bot_data["funnel"].pending_count()))
+    REGISTRY.register(Gauge("xenon_user_data_entries", "Users with user_data in memory",
+                            lambda: len(application.user_data)))
+    REGISTRY.register(Gauge("xenon_signup_drafts", "Unfinished signups kept in memory",
+                            lambda: sum(1 for user_data in application.user_data.values() if DRAFT_KEY in user_data)))
+
+
+# Health-check: реальное состояние event loop и связи с Bot API
+def make_health_route(application: Application):
+    api_request = application.bot.request
+    monitor = application.bot_data["loop_monitor"]
+
+    async def health_route(request: Request) -> Response:
+        # Если бот давно не ходил в Bot API, проверяем связь запросом getMe
+        if api_request.last_success is None or time.monotonic() - api_request.last_success > HEALTH_API_PROBE_AGE:
+            try:
+                await asyncio.wait_for(application.bot.get_me(), timeout=5)
+            except Exception:
+                pass
+        api_ok = api_request.last_success is not None and (
+            api_request.last_error_at is None or api_request.last_success > api_request.last_error_at
+        )
+        loop_ok = not monitor.stalled() and monitor.lag < HEALTH_MAX_LOOP_LAG
+        status = {
+            "status": "ok" if api_ok and loop_ok else "degraded",
+            "event_loop": {"ok": loop_ok, "lag_ms": round(monitor.lag * 1000, 1)},
+            "bot_api": {
+                "ok": api_ok,
+                "last_success_s_ago": None if api_request.last_success is None else round(time.monotonic() - api_request.last_success, 1),
+                "last_error": api_request.last_error,
+            },
+            "updates": application.queue_stats(),
+        }
+        body = json.dumps(status, ensure_ascii=False).encode()
+        return Response(200 if status["status"] == "ok" else 503, body, "application/json")
+    return health_route
+
+
+# Метрики в формате Prometheus
+async def metrics_route(request: Request) -> Response:
+    return Response(200, REGISTRY.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+
+
+# Глубина очереди и число апдейтов в работе
+def make_queue_route(application: OrderedApplication):
+    async def queue_route(request: Request) -> Response:
+        body = json.dumps(application.queue_stats()).encode()
+        return Response(200, body, "application/json")
+    return queue_route
+
+
+# Приём апдейтов от Telegram: кладём их прямо в очередь Application
+def make_webhook_route(application: OrderedApplication, secret_token: str):
+    async def webhook_route(request: Request) -> Response:
+        if secret_token and request.headers.get("x-telegram-bot-api-secret-token") != secret_token:
+            return Response(403)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400, b"Invalid JSON")
+        await application.enqueue(Update.de_json(data, application.bot))
+        return Response(200)
+    return webhook_route
+
+
+def reload_formats_on_signal(application: Application) -> None:
+    try:
+        reload_catalog()
+        logging.info("Format catalog reloaded")
+    except Exception as e:
+        logging.error(f"Failed to reload formats: {e}")
+        return
+    application.create_task(application.catalog_reloaded())
+
+
+# Запуск приложения и HTTP-сервера в одном event loop (и для polling, и для webhook)
+# server — уже запущенный сервер при быстром старте (startup.py), on_ready вызывается, как только webhook-маршрут готов
+async def serve(
+    application: Application,
+    mode: str,
+    server: HttpServer = None,
+    profile: StartupProfile = None,
+    on_ready=None,
+) -> None:
+    if server is None:
+        server = HttpServer("0.0.0.0", int(os.environ.get("PORT", 10000)))
+
+    if mode in ("webhook", "worker"):
+        # Воркер принимает апдейты от диспетчера на тот же путь и с тем же секретом, что и webhook Telegram
+        webhook_path = "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+        secret_token = os.getenv("WEBHOOK_SECRET", "")
+        server.route("POST", webhook_path, make_webhook_route(application, secret_token))
+    if mode == "webhook":
+        base_url = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+        if not base_url:
+            raise RuntimeError("WEBHOOK_URL не задан. Укажите публичный адрес сервиса для режима webhook.")
+    if on_ready is not None:
+        # Апдейты уже можно класть в очередь: обработка начнётся после application.start()
+        on_ready()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+    if hasattr(signal, "SIGHUP"):
+        # kill -HUP <pid> перечитывает formats.json так же, как /reload_formats
+        loop.add_signal_handler(signal.SIGHUP, reload_formats_on_signal, application)
+
+    # initialize() делает первый запрос к Bot API (getMe)
+    async with application:
+        if profile is not None:
+            profile.mark("first Bot API call")
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        # Health-check отражает реальное состояние, только когда Application запущен
+        health_route = make_health_route(application)
+        server.route("GET", "/", health_route)
+        server.route("GET", "/healthz", health_route)
+        server.route("GET", "/metrics", metrics_route)
+        server.route("GET", "/queue", make_queue_route(application))
+        if not server.running:
+            await server.start()
+        try:
+            if mode == "webhook":
+                await application.bot.set_webhook(
+                    url=base_url.rstrip("/") + webhook_path,
+                    secret_token=secret_token or None,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logging.info("Bot is running in webhook mode...")
+            elif mode == "worker":
+                logging.info("Bot is running as a worker behind the dispatcher...")
+            else:
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                logging.info("Bot is starting polling...")
+            if profile is not None:
+                profile.mark("start")
+                logging.info(profile.report())
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+
+
+# Сборка приложения для режима BOT_MODE: webhook для продакшена, polling (по умолчанию)
+# для локальной разработки, worker — один из нескольких воркеров за dispatcher.py
+def application_for_mode(token: str, mode: str, profile: StartupProfile = None) -> Application:
+    # BOT_API_URL — локальный сервер Bot API вместо api.telegram.org
+    base_url = os.getenv("BOT_API_URL")
+    if mode == "worker":
+        state_store = SQLiteStateStore(os.getenv("STATE_STORE_PATH") or database_path())
+        return build_application(token, webhook_mode=True, base_url=base_url, state_store=state_store, profile=profile)
+    return build_application(token, webhook_mode=mode == "webhook", base_url=base_url, profile=profile)
+
+
+# Главная функция запуска бота
+def main() -> None:
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        logging.error("BOT_TOKEN не задан. Поместите токен вашего бота в переменную окружения BOT_TOKEN.")
+        return
+    # Импорты к этому моменту уже выполнены; полный отчёт о запуске даёт python startup.py
+    profile = StartupProfile()
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    application = application_for_mode(token, mode, profile)
     try:
-        if admin_id:
-            await context.bot.send_message(chat_id=admin_id, text=error_message)
-    except TelegramError:
+        asyncio.run(serve(application, mode, profile=profile))
+    except KeyboardInterrupt:
         pass
+
+if __name__ == "__main__":
+    main()
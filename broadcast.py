@@ -0,0 +1,363 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from outbox import parse_chat_id
+from ratelimit import TokenBucket
+from storage import connect
+
+# Рассылка объявлений всем, кто запускал бота.
+# Подписчики — пользователи, которые нажимали /start или оставляли заявку (таблица subscribers).
+# Рассылка хранится в таблице broadcasts вместе с курсором — user_id последнего обработанного подписчика,
+# поэтому после падения или рестарта она продолжается с места остановки, а не с начала.
+# Отправка идёт в фоне под общим лимитом (BROADCAST_RATE сообщений в секунду, у Telegram ~30 на бота),
+# 429 ставит на паузу всю рассылку. Каждый подписчик получает одно сообщение, поэтому лимит на один чат
+# (~1 сообщение в секунду) соблюдается сам собой.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    user_id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    language TEXT,
+    source TEXT NOT NULL,
+    subscribed_at REAL NOT NULL,
+    last_seen_at REAL NOT NULL,
+    blocked_at REAL
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    report_chat_id TEXT,
+    report_message_id INTEGER,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS broadcasts_status ON broadcasts (status);
+"""
+
+RUNNING, DONE, STOPPED = "running", "done", "stopped"
+_SENT, _FAILED, _BLOCKED = "sent", "failed", "blocked"
+
+# Рассылку ведёт один процесс: он продлевает аренду после каждой пачки. Если процесс упал,
+# через LEASE_TIMEOUT секунд рассылку подхватит другой воркер или этот же после рестарта
+LEASE_TIMEOUT = 60.0
+# Попыток на одного получателя при сетевых ошибках (429 попыткой не считается)
+MAX_ATTEMPTS = 3
+# Пауза перед повтором после сбоя отправки или общей базы
+RESUME_DELAY = 5.0
+
+
+class SubscriberStore:
+    def __init__(self, path: str) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+
+    def add(self, user_id: int, chat_id: int, language: Optional[str], source: str) -> None:
+        # Повторный /start обновляет данные; пользователь, который заблокировал бота и вернулся, снова получает рассылки
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO subscribers (user_id, chat_id, language, source, subscribed_at, last_seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET chat_id = excluded.chat_id, language = excluded.language, "
+                "last_seen_at = excluded.last_seen_at, blocked_at = NULL",
+                (user_id, chat_id, language, source, now, now),
+            )
+
+    def active_count(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscribers WHERE blocked_at IS NULL").fetchone()[0]
+
+    def batch_after(self, user_id: int, limit: int) -> List[Tuple[int, int]]:
+        # Следующие подписчики по возрастанию user_id — порядок, в котором движется курсор рассылки
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT user_id, chat_id FROM subscribers WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+
+    def mark_blocked(self, user_ids: List[int]) -> None:
+        if not user_ids:
+            return
+        with self._db_lock:
+            self._conn.executemany(
+                "UPDATE subscribers SET blocked_at = ? WHERE user_id = ?", [(time.time(), user_id) for user_id in user_ids]
+            )
+
+
+class BroadcastProgress(NamedTuple):
+    id: int
+    status: str
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        path: str,
+        subscribers: SubscriberStore,
+        rate: float = 25.0,
+        batch_size: int = 50,
+        max_in_flight: int = 32,
+        report_interval: float = 10.0,
+        describe: Callable[[BroadcastProgress], str] = str,
+    ) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self.subscribers = subscribers
+        # Без запаса на всплеск: сообщения идут равномерно, а не пачкой в начале каждой секунды
+        self._bucket = TokenBucket(rate=rate, capacity=1.0)
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.report_interval = report_interval
+        # Текст отчёта о ходе рассылки для админского чата (язык задаёт bot.py)
+        self.describe = describe
+        self._paused_until = 0.0
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._current: Optional[int] = None
+
+    # --- Управление из обработчиков команд ---
+
+    def create(self, text: str, report_chat_id: Union[int, str]) -> Optional[BroadcastProgress]:
+        # Новая рассылка; None, если другая ещё идёт. Проверка и вставка — одна транзакция,
+        # поэтому две рассылки не запустятся одновременно и из разных воркеров
+        total = self.subscribers.active_count()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = self._conn.execute("SELECT id FROM broadcasts WHERE status = ? LIMIT 1", (RUNNING,)).fetchone()
+                if running is None:
+                    cursor = self._conn.execute(
+                        "INSERT INTO broadcasts (text, status, total, report_chat_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (text, RUNNING, total, str(report_chat_id), time.time()),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if running is not None:
+            return None
+        self.notify()
+        return BroadcastProgress(cursor.lastrowid, RUNNING, total, 0, 0, 0)
+
+    def set_report_message(self, broadcast_id: int, message_id: int) -> None:
+        # Сообщение в админском чате, которое рассылка редактирует, сообщая о ходе отправки
+        with self._db_lock:
+            self._conn.execute("UPDATE broadcasts SET report_message_id = ? WHERE id = ?", (message_id, broadcast_id))
+
+    def running(self) -> Optional[BroadcastProgress]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT id, status, total, sent, failed, blocked FROM broadcasts WHERE status = ? LIMIT 1", (RUNNING,)
+            ).fetchone()
+        return BroadcastProgress(*row) if row is not None else None
+
+    def stop_running(self) -> Optional[int]:
+        # Процесс, который ведёт рассылку, заметит остановку после текущей пачки
+        current = self.running()
+        if current is None:
+            return None
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (STOPPED, time.time(), current.id, RUNNING),
+            )
+        return current.id
+
+    def notify(self) -> None:
+        # Можно вызывать и из пула потоков: команды админа обращаются к базе через asyncio.to_thread
+        wakeup = self._wakeup
+        if wakeup is not None:
+            self._loop.call_soon_threadsafe(wakeup.set)
+
+    # --- Фоновая отправка ---
+
+    def start(self, bot: Bot) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        current = self._current
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._wakeup = None
+        if current is not None:
+            # Отдаём аренду сразу: после рестарта рассылка продолжится без ожидания LEASE_TIMEOUT
+            with self._db_lock:
+                self._conn.execute("UPDATE broadcasts SET lease_until = 0 WHERE id = ?", (current,))
+
+    async def _run(self, bot: Bot) -> None:
+        # Запросы к общей базе идут в пуле потоков: транзакция другого воркера может держать блокировку до busy_timeout
+        while True:
+            self._wakeup.clear()
+            try:
+                broadcast_id = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to check broadcasts: {e}")
+                await asyncio.sleep(RESUME_DELAY)
+                continue
+            if broadcast_id is None:
+                # Рассылки нет или её ведёт другой процесс; проверяем снова, когда истечёт его аренда
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), LEASE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._current = broadcast_id
+            try:
+                await self._process(bot, broadcast_id)
+            except (TelegramError, OSError, sqlite3.Error) as e:
+                # Ошибка не останавливает рассылки до рестарта: эта продолжится с курсора, когда истечёт аренда
+                logging.error(f"Broadcast #{broadcast_id} failed, it will be resumed: {e}")
+                await asyncio.sleep(RESUME_DELAY)
+            finally:
+                self._current = None
+
+    def _claim(self) -> Optional[int]:
+        now = time.time()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT id FROM broadcasts WHERE status = ? AND lease_until < ? ORDER BY id LIMIT 1", (RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = self._conn.execute(
+                "UPDATE broadcasts SET lease_until = ? WHERE id = ? AND status = ? AND lease_until < ?",
+                (now + LEASE_TIMEOUT, row[0], RUNNING, now),
+            )
+        return row[0] if cursor.rowcount == 1 else None
+
+    def _load(self, broadcast_id: int) -> Tuple[str, int]:
+        with self._db_lock:
+            return self._conn.execute("SELECT text, cursor FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+
+    async def _process(self, bot: Bot, broadcast_id: int) -> None:
+        text, position = await asyncio.to_thread(self._load, broadcast_id)
+        logging.info(f"Broadcast #{broadcast_id} is running from subscriber {position}")
+        reported_at = time.monotonic()
+        while True:
+            batch = await asyncio.to_thread(self.subscribers.batch_after, position, self.batch_size)
+            if not batch:
+                await asyncio.to_thread(self._finish, broadcast_id)
+                break
+            results = await asyncio.gather(*(self._deliver(bot, chat_id, text) for _, chat_id in batch))
+            blocked = [user_id for (user_id, _), result in zip(batch, results) if result == _BLOCKED]
+            await asyncio.to_thread(self.subscribers.mark_blocked, blocked)
+            position = batch[-1][0]
+            # Курсор и счётчики сохраняются после каждой пачки: после падения повторно уйдёт не больше одной пачки
+            if not await asyncio.to_thread(self._advance, broadcast_id, position, results):
+                logging.info(f"Broadcast #{broadcast_id} was stopped")
+                break
+            if time.monotonic() - reported_at >= self.report_interval:
+                await self._report(bot, broadcast_id)
+                reported_at = time.monotonic()
+        await self._report(bot, broadcast_id)
+        progress = await asyncio.to_thread(self._progress, broadcast_id)
+        logging.info(f"Broadcast #{broadcast_id} {progress.status}: {progress.sent} sent, "
+                     f"{progress.failed} failed, {progress.blocked} blocked the bot")
+
+    def _advance(self, broadcast_id: int, position: int, results: List[str]) -> bool:
+        # False — рассылку остановили командой, продолжать не нужно
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE broadcasts SET cursor = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?, "
+                "lease_until = ? WHERE id = ? AND status = ?",
+                (position, results.count(_SENT), results.count(_FAILED), results.count(_BLOCKED),
+                 time.time() + LEASE_TIMEOUT, broadcast_id, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def _finish(self, broadcast_id: int) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = ?, lease_until = 0 WHERE id = ? AND status = ?",
+                (DONE, time.time(), broadcast_id, RUNNING),
+            )
+
+    def _progress(self, broadcast_id: int) -> BroadcastProgress:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT id, status, total, sent, failed, blocked FROM broadcasts WHERE id = ?", (broadcast_id,)
+            ).fetchone()
+        return BroadcastProgress(*row)
+
+    def _report_message(self, broadcast_id: int) -> Tuple[Optional[str], Optional[int]]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT report_chat_id, report_message_id FROM broadcasts WHERE id = ?", (broadcast_id,)
+            ).fetchone()
+
+    async def _report(self, bot: Bot, broadcast_id: int) -> None:
+        # Отчёт — одно сообщение, которое редактируется раз в report_interval секунд; ошибки отчёта рассылку не останавливают
+        chat_id, message_id = await asyncio.to_thread(self._report_message, broadcast_id)
+        if not message_id:
+            return
+        progress = await asyncio.to_thread(self._progress, broadcast_id)
+        try:
+            await bot.edit_message_text(self.describe(progress), chat_id=parse_chat_id(chat_id), message_id=message_id)
+        except (TelegramError, OSError) as e:
+            logging.info(f"Cannot update the report of broadcast #{broadcast_id}: {e}")
+
+    async def _acquire(self) -> None:
+        # Токен общего лимита рассылки; после 429 ждём, пока истечёт пауза, которую назначил Telegram
+        while True:
+            wait = max(self._paused_until - time.monotonic(), self._bucket.delay())
+            if wait <= 0 and self._bucket.try_acquire():
+                return
+            await asyncio.sleep(max(wait, 0.001))
+
+    async def _deliver(self, bot: Bot, chat_id: int, text: str) -> str:
+        async with self._in_flight:
+            attempt = 0
+            while attempt < MAX_ATTEMPTS:
+                await self._acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                    return _SENT
+                except RetryAfter as e:
+                    # Лимит превышен для всего бота — пауза для всех отправок рассылки, сообщение повторяется
+                    logging.warning(f"Broadcast is throttled, pausing for {e.retry_after}s")
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                except Forbidden:
+                    # Пользователь заблокировал бота или удалил аккаунт
+                    return _BLOCKED
+                except BadRequest as e:
+                    if "chat not found" in str(e).lower():
+                        return _BLOCKED
+                    logging.error(f"Broadcast message to {chat_id} was rejected: {e}")
+                    return _FAILED
+                except (TelegramError, OSError) as e:
+                    attempt += 1
+                    logging.warning(f"Broadcast message to {chat_id} failed (attempt {attempt}): {e}")
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            return _FAILED
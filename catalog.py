@@ -0,0 +1,80 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Каталог форматов (пакетов сессий). Загружается из JSON один раз,
+# клавиатура и таблица поиска по callback_data строятся сразу и переиспользуются всеми обработчиками.
+# Перезагрузка собирает новый каталог целиком и подменяет ссылку одним присваиванием.
+
+DEFAULT_FORMATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formats.json")
+
+
+def format_price(price: int) -> str:
+    # 105000 -> "105 000 ₽"
+    return f"{price:,} ₽".replace(",", " ")
+
+
+@dataclass(frozen=True)
+class FormatOption:
+    code: str
+    label: str
+    price: int
+
+    @property
+    def callback_data(self) -> str:
+        return f"format_{self.code}"
+
+    @property
+    def price_label(self) -> str:
+        return format_price(self.price)
+
+    @property
+    def button_text(self) -> str:
+        return f"{self.label} — {self.price_label}"
+
+
+class FormatCatalog:
+    def __init__(self, options: Iterable[FormatOption]) -> None:
+        self.options: Tuple[FormatOption, ...] = tuple(options)
+        if not self.options:
+            raise ValueError("Format catalog is empty")
+        self.by_callback: Dict[str, FormatOption] = {option.callback_data: option for option in self.options}
+        if len(self.by_callback) != len(self.options):
+            raise ValueError("Format codes must be unique")
+        self.keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(option.button_text, callback_data=option.callback_data)] for option in self.options]
+        )
+
+    def get(self, callback_data: str) -> Optional[FormatOption]:
+        return self.by_callback.get(callback_data)
+
+
+def load_catalog(path: str) -> FormatCatalog:
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    return FormatCatalog(FormatOption(str(item["code"]), item["label"], int(item["price"])) for item in items)
+
+
+def formats_path() -> str:
+    return os.getenv("FORMATS_PATH", DEFAULT_FORMATS_PATH)
+
+
+_catalog: Optional[FormatCatalog] = None
+
+
+def get_catalog() -> FormatCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog(formats_path())
+    return _catalog
+
+
+def reload_catalog(path: Optional[str] = None) -> FormatCatalog:
+    # Если файл битый, исключение уйдёт наверх, а старый каталог останется на месте
+    global _catalog
+    catalog = load_catalog(path or formats_path())
+    _catalog = catalog
+    return catalog
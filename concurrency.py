@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import UPDATE_QUEUE_LAG
+
+# Параллельная обработка апдейтов разных пользователей со строгим порядком внутри одного пользователя.
+# Application создаёт задачу на каждый апдейт в порядке очереди; задача сначала встаёт в «полосу»
+# своего пользователя (FIFO-замок), и только потом занимает один из max_concurrent слотов.
+# Поэтому апдейты, ждущие своей очереди, не занимают слоты других пользователей,
+# а состояние ConversationHandler меняется в том же порядке, в каком пришли апдейты.
+
+# Потолок числа задач, которые Application держит одновременно (включая ждущие в полосах)
+MAX_PENDING_TASKS = 4096
+
+T = TypeVar("T")
+
+
+class _Lane:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # Сколько апдейтов сейчас в полосе (обрабатывается + ждут)
+        self.users = 0
+
+
+def ordering_key(update: object) -> Optional[Hashable]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class OrderedApplication(Application):
+    def __init__(self, max_concurrent: int = 64, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._in_flight = 0
+        self._waiting = 0
+        # update_id -> время постановки в очередь (для метрики задержки очереди)
+        self._arrivals: Dict[int, float] = {}
+
+    async def enqueue(self, update: Update) -> None:
+        self._arrivals[update.update_id] = time.time()
+        await self.update_queue.put(update)
+
+    def _observe_lag(self, update: object) -> None:
+        if not isinstance(update, Update):
+            return
+        arrived = self._arrivals.pop(update.update_id, None)
+        if arrived is None and update.message is not None:
+            # Апдейты из polling кладутся в очередь напрямую — берём время сообщения (точность до секунды)
+            arrived = update.message.date.timestamp()
+        if arrived is not None:
+            UPDATE_QUEUE_LAG.observe(max(0.0, time.time() - arrived))
+
+    async def process_update(self, update: object) -> None:
+        self._observe_lag(update)
+        key = ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await self._process_counted(update)
+            return
+
+        lane = self._enter_lane(key)
+        self._waiting += 1
+        started = False
+        try:
+            async with lane.lock:
+                async with self._slots:
+                    self._waiting -= 1
+                    started = True
+                    await self._process_in_lane(key, update)
+        finally:
+            if not started:
+                self._waiting -= 1
+            self._leave_lane(key, lane)
+
+    def _enter_lane(self, key: Hashable) -> _Lane:
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        lane.users += 1
+        return lane
+
+    def _leave_lane(self, key: Hashable, lane: _Lane) -> None:
+        lane.users -= 1
+        if lane.users == 0:
+            # Полоса живёт, только пока у пользователя есть апдейты в работе
+            del self._lanes[key]
+
+    async def run_in_lane(self, key: Hashable, callback: Callable[[], Awaitable[T]]) -> T:
+        # Фоновая работа с состоянием пользователя (чистка черновиков) в общей очереди с его апдейтами:
+        # не пересекается ни с обработкой апдейта, ни с загрузкой и записью состояния воркером
+        lane = self._enter_lane(key)
+        try:
+            async with lane.lock:
+                return await callback()
+        finally:
+            self._leave_lane(key, lane)
+
+    async def _process_in_lane(self, key: Hashable, update: object) -> None:
+        # Выполняется под замком полосы key: апдейты этого пользователя сюда по одному
+        await self._process_counted(update)
+
+    async def _process_counted(self, update: object) -> None:
+        self._in_flight += 1
+        try:
+            await super().process_update(update)
+        finally:
+            self._in_flight -= 1
+
+    def is_busy(self, key: Hashable) -> bool:
+        # У пользователя есть апдейты в работе или в очереди его полосы
+        return key in self._lanes
+
+    async def refresh_user_state(self, key: Hashable) -> bool:
+        # Вызывается в полосе key. False — состояние пользователя в памяти неактуально и трогать его нельзя;
+        # у одиночного процесса память и есть источник истины
+        return True
+
+    def mark_user_changed(self, key: Hashable) -> None:
+        # user_data изменены вне обработки апдейта (например, чисткой черновиков) — записать их в хранилище
+        self.mark_data_for_update_persistence(user_ids=key)
+
+    async def catalog_reloaded(self) -> None:
+        # Каталог форматов перечитан в этом процессе; воркеры сообщают об этом остальным воркерам
+        pass
+
+    def queue_stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.update_queue.qsize(),
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "active_users": len(self._lanes),
+            "max_concurrent": self.max_concurrent,
+        }
+
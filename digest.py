@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+from outbox import MAX_MESSAGE_LENGTH, AdminOutbox, insert_message, split_text
+from storage import connect
+
+# Дайджест заявок для админского чата. В пиковые часы заявки не отправляются по одной, а копятся в SQLite
+# и уходят одним сообщением, когда их набралось max_items или самая старая ждёт max_delay секунд.
+# Когда сбрасывать дайджест, решают задачи JobQueue в bot.py; доставкой занимается outbox.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digest_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class AdminDigest:
+    def __init__(
+        self,
+        path: str,
+        max_items: int = 10,
+        max_delay: float = 300.0,
+        urgent_within: float = 86400.0,
+        compose: Callable[[List[str]], str] = "\n\n".join,
+    ) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self.max_items = max_items
+        self.max_delay = max_delay
+        # Заявки на сессию раньше, чем через urgent_within секунд, отправляются сразу, минуя дайджест
+        self.urgent_within = urgent_within
+        # Сборка сообщения из заявок (заголовок на языке администратора задаёт bot.py)
+        self.compose = compose
+
+    def add(self, chat_id: Union[int, str], text: str) -> int:
+        # Возвращает, сколько заявок теперь ждёт отправки
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO digest_items (chat_id, text, created_at) VALUES (?, ?, ?)",
+                (str(chat_id), text, time.time()),
+            )
+            return self._conn.execute("SELECT COUNT(*) FROM digest_items").fetchone()[0]
+
+    def pending_count(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM digest_items").fetchone()[0]
+
+    def oldest_created_at(self) -> Optional[float]:
+        with self._db_lock:
+            return self._conn.execute("SELECT MIN(created_at) FROM digest_items").fetchone()[0]
+
+    def flush(self, outbox: AdminOutbox) -> int:
+        # Склеивает накопленные заявки в сообщения не длиннее лимита и ставит их в outbox.
+        # Выборка, постановка в outbox и удаление — одна транзакция в общей базе: заявка не потеряется
+        # при рестарте и не уйдёт дважды, даже если дайджест одновременно сбрасывают несколько воркеров
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT id, chat_id, text FROM digest_items ORDER BY id").fetchall()
+                by_chat = {}
+                for _id, chat_id, text in rows:
+                    by_chat.setdefault(chat_id, []).append(text)
+                for chat_id, texts in by_chat.items():
+                    for message in self._split(texts):
+                        insert_message(self._conn, chat_id, message)
+                if rows:
+                    self._conn.execute("DELETE FROM digest_items WHERE id <= ?", (rows[-1][0],))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if rows:
+            outbox.notify()
+        return len(rows)
+
+    def _split(self, texts: List[str]) -> List[str]:
+        messages = []
+        chunk: List[str] = []
+        length = 0
+        # Заявка длиннее лимита делится на части, каждая идёт отдельным элементом дайджеста
+        for text in (part for text in texts for part in split_text(text)):
+            if chunk and length + len(text) + 2 > MAX_MESSAGE_LENGTH:
+                messages.append(chunk)
+                chunk, length = [], 0
+            chunk.append(text)
+            length += len(text) + 2
+        messages.append(chunk)
+        return [self.compose(items) for items in messages]
@@ -0,0 +1,138 @@
+import os
+import json
+import signal
+import asyncio
+import logging
+from typing import List
+
+import httpx
+from dotenv import load_dotenv
+from telegram import Bot, Update
+
+from sharding import HashRing, routing_key
+from webserver import HttpServer, Request, Response
+
+# Диспетчер перед несколькими воркерами бота (BOT_MODE=worker).
+# Принимает webhook Telegram и пересылает апдейт воркеру, которому по consistent hashing принадлежит пользователь.
+# Если владелец недоступен, апдейт уходит следующему воркеру по кольцу: состояние в общем хранилище,
+# поэтому диалог продолжится. Если не ответил никто, отвечаем 503 — Telegram повторит апдейт позже.
+
+load_dotenv()
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+FORWARD_TIMEOUT = 10.0
+
+
+# Список воркеров: по одному адресу на строку в WORKERS_FILE или через запятую в WORKERS
+def load_workers() -> List[str]:
+    workers_file = os.getenv("WORKERS_FILE")
+    if workers_file:
+        with open(workers_file, encoding="utf-8") as f:
+            raw = f.read().split()
+    else:
+        raw = os.getenv("WORKERS", "").split(",")
+    return [worker.strip() for worker in raw if worker.strip()]
+
+
+class Dispatcher:
+    def __init__(self, workers: List[str], secret_token: str) -> None:
+        self.ring = HashRing(workers)
+        self.secret_token = secret_token
+        self._client = httpx.AsyncClient(timeout=FORWARD_TIMEOUT)
+
+    def reload(self) -> None:
+        # Новое кольцо строится целиком: добавленный или убранный воркер забирает или отдаёт ~1/N пользователей
+        try:
+            workers = load_workers()
+        except OSError as e:
+            logging.error(f"Failed to reload workers: {e}")
+            return
+        if not workers:
+            logging.error("Worker list is empty, keeping the current one")
+            return
+        self.ring = HashRing(workers)
+        logging.info(f"Workers reloaded: {', '.join(workers)}")
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def webhook_route(self, request: Request) -> Response:
+        if self.secret_token and request.headers.get("x-telegram-bot-api-secret-token") != self.secret_token:
+            return Response(403)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400, b"Invalid JSON")
+        key = routing_key(data)
+        headers = {"Content-Type": "application/json"}
+        if self.secret_token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.secret_token
+        for worker in self.ring.nodes_for(key if key is not None else data.get("update_id")):
+            try:
+                response = await self._client.post(worker, content=request.body, headers=headers)
+            except httpx.HTTPError as e:
+                logging.warning(f"Worker {worker} is unavailable: {e}")
+                continue
+            if response.status_code == 200:
+                return Response(200)
+            logging.warning(f"Worker {worker} answered {response.status_code}")
+        return Response(503)
+
+    async def health_route(self, request: Request) -> Response:
+        body = json.dumps({"status": "ok", "workers": self.ring.nodes}).encode()
+        return Response(200, body, "application/json")
+
+
+async def serve(dispatcher: Dispatcher) -> None:
+    port = int(os.environ.get("PORT", 10000))
+    webhook_path = "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+    server = HttpServer("0.0.0.0", port)
+    server.route("GET", "/", dispatcher.health_route)
+    server.route("GET", "/healthz", dispatcher.health_route)
+    server.route("POST", webhook_path, dispatcher.webhook_route)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    if hasattr(signal, "SIGHUP"):
+        # kill -HUP <pid> перечитывает список воркеров
+        loop.add_signal_handler(signal.SIGHUP, dispatcher.reload)
+
+    await server.start()
+    try:
+        # Webhook Telegram указывает на диспетчер; без BOT_TOKEN считаем, что он уже настроен
+        token = os.getenv("BOT_TOKEN")
+        base_url = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+        if token and base_url:
+            async with Bot(token) as bot:
+                await bot.set_webhook(
+                    url=base_url.rstrip("/") + webhook_path,
+                    secret_token=dispatcher.secret_token or None,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+        logging.info(f"Dispatcher is running with workers: {', '.join(dispatcher.ring.nodes)}")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await dispatcher.close()
+
+
+def main() -> None:
+    workers = load_workers()
+    if not workers:
+        logging.error("Список воркеров пуст. Укажите адреса воркеров в WORKERS или WORKERS_FILE.")
+        return
+    dispatcher = Dispatcher(workers, os.getenv("WEBHOOK_SECRET", ""))
+    try:
+        asyncio.run(serve(dispatcher))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+from typing import Optional
+
+# Черновик заявки: данные незаконченной записи с фиксированным набором полей.
+# Хранится в user_data[DRAFT_KEY] как объект со __slots__ (в несколько раз компактнее словаря со строковыми ключами);
+# persistence и общее хранилище воркеров пишут его словарём через to_dict(), а get_draft() восстанавливает объект
+# при первом обращении. updated_at — время последнего шага, по нему бот напоминает о брошенной записи и удаляет её.
+
+DRAFT_KEY = "draft"
+
+
+class Draft:
+    __slots__ = (
+        "name", "phone", "time", "slot_start", "address", "format_code", "format_label", "format_price", "comment",
+        "editing_field", "language", "created_at", "updated_at", "reminded", "steps",
+    )
+
+    def __init__(self, language: Optional[str] = None, now: Optional[float] = None) -> None:
+        self.name: Optional[str] = None
+        self.phone: Optional[str] = None
+        # Время сессии текстом (на языке администратора) и начало забронированного окна, если время выбрано кнопкой
+        self.time: Optional[str] = None
+        self.slot_start: Optional[int] = None
+        self.address: Optional[str] = None
+        self.format_code: Optional[str] = None
+        self.format_label: Optional[str] = None
+        self.format_price: Optional[str] = None
+        self.comment: Optional[str] = None
+        # Поле, которое пользователь сейчас редактирует со сводки
+        self.editing_field: Optional[str] = None
+        self.language = language
+        self.created_at = self.updated_at = now or time.time()
+        self.reminded = False
+        # Шаги воронки, на которых черновик уже был (битовая маска, см. funnel.STEPS)
+        self.steps = 0
+
+    def touch(self, now: Optional[float] = None) -> None:
+        self.updated_at = now or time.time()
+        self.reminded = False
+
+    def has_format(self) -> bool:
+        return self.format_label is not None and self.format_price is not None
+
+    def is_complete(self) -> bool:
+        # Все поля, без которых заявку нельзя отправить (комментарий необязателен)
+        return None not in (self.name, self.phone, self.time, self.address, self.format_label)
+
+    def to_dict(self) -> dict:
+        # Пустые поля не пишем: черновик в базе занимает столько, сколько пользователь успел заполнить
+        return {field: value for field in self.__slots__ for value in (getattr(self, field),) if value is not None}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Draft":
+        draft = cls(data.get("language"), data.get("created_at"))
+        for field in cls.__slots__:
+            if field in data:
+                setattr(draft, field, data[field])
+        if "updated_at" not in data:
+            draft.updated_at = draft.created_at
+        return draft
+
+    def __repr__(self) -> str:
+        return f"Draft({self.to_dict()!r})"
+
+
+# Поля черновика, которые до появления Draft лежали прямо в user_data
+_LEGACY_FIELDS = ("name", "phone", "time", "slot_start", "address", "format_code", "format_label", "format_price", "comment", "editing_field")
+
+
+def get_draft(user_data: dict) -> Optional[Draft]:
+    value = user_data.get(DRAFT_KEY)
+    if isinstance(value, Draft) or (value is None and not any(field in user_data for field in _LEGACY_FIELDS)):
+        return value
+    if value is None:
+        # user_data, сохранённые до появления черновиков: поля переносим в Draft
+        value = {field: user_data.pop(field) for field in _LEGACY_FIELDS if field in user_data}
+    # Из persistence или общего хранилища черновик приходит словарём
+    draft = user_data[DRAFT_KEY] = Draft.from_dict(value)
+    return draft
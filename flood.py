@@ -0,0 +1,40 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from ratelimit import TokenBucket
+
+# Ограничение частоты апдейтов от одного пользователя (token bucket на каждого).
+# Корзины лежат в OrderedDict в порядке последней активности: проверка и вытеснение — O(1),
+# память ограничена max_users, а корзины простаивающих пользователей удаляются.
+
+
+class FloodControl:
+    def __init__(self, rate: float, burst: float, max_users: int = 10000, idle_ttl: float = 600.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        else:
+            self._buckets.move_to_end(key)
+        self._evict(now)
+        return bucket.try_acquire(now=now)
+
+    def _evict(self, now: float) -> None:
+        # Самые давно активные корзины — в начале словаря
+        while self._buckets:
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if len(self._buckets) > self.max_users or now - oldest.updated > self.idle_ttl:
+                del self._buckets[oldest_key]
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self._buckets)
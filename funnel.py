@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta, tzinfo
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import ConversationHandler
+
+from drafts import get_draft
+from storage import connect
+
+# Воронка записи: счётчики по дням, шагам диалога и форматам, которые обновляются на каждом переходе.
+# /stats читает только эти агрегаты (строк — дни × шаги × форматы), поэтому отчёт за любой период
+# строится сразу, сколько бы месяцев истории ни накопилось. Переходы копятся в памяти и записываются
+# в базу одним UPSERT раз в flush_interval секунд; несколько воркеров складывают свои счётчики в те же строки.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS funnel_daily (
+    day TEXT NOT NULL,
+    step TEXT NOT NULL,
+    format TEXT NOT NULL,
+    entered INTEGER NOT NULL DEFAULT 0,
+    transitions INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, step, format)
+) WITHOUT ROWID;
+"""
+
+_UPSERT = (
+    "INSERT INTO funnel_daily (day, step, format, entered, transitions, revenue) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (day, step, format) DO UPDATE SET entered = entered + excluded.entered, "
+    "transitions = transitions + excluded.transitions, revenue = revenue + excluded.revenue"
+)
+
+# Шаги воронки: START — вход в запись, имена состояний диалога — переход в состояние,
+# SUBMITTED/CANCELLED/EXPIRED — чем закончилась запись
+STEPS = (
+    "START", "NAME", "PHONE", "TIME", "ADDRESS", "FORMAT_STATE", "COMMENT", "CONFIRM", "CHOOSE_FIELD", "NEW_VALUE",
+    "SUBMITTED", "CANCELLED", "EXPIRED",
+)
+# Основной путь, по которому считается отвал между шагами (выбор формата в диалоге необязателен)
+MAIN_PATH = ("START", "NAME", "PHONE", "TIME", "ADDRESS", "COMMENT", "CONFIRM", "SUBMITTED")
+
+# Бит шага в Draft.steps: entered считает каждую запись на шаге один раз, transitions — все переходы
+_STEP_BITS = {step: 1 << index for index, step in enumerate(STEPS)}
+
+def reached(draft, step: str) -> bool:
+    # Был ли черновик на шаге: черновик, созданный выбором формата из меню, до START не доходил
+    return draft is not None and bool(draft.steps & _STEP_BITS[step])
+
+
+# Счётчики одной строки: entered, transitions, revenue
+Counters = List[int]
+
+
+class FunnelStats:
+    def __init__(self, path: str, tz: Optional[tzinfo] = None, flush_interval: float = 10.0) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self.tz = tz
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str, str], Counters] = {}
+        self._day = ""
+        self._day_ends_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def day(self, now: Optional[float] = None) -> str:
+        # Дата в часовом поясе расписания; пересчитывается раз в сутки, а не на каждом переходе
+        now = now or time.time()
+        if now >= self._day_ends_at:
+            today = datetime.fromtimestamp(now, self.tz).date()
+            self._day = today.isoformat()
+            self._day_ends_at = datetime.combine(today + timedelta(days=1), dt_time(0), self.tz).timestamp()
+        return self._day
+
+    def record(self, step: str, draft=None, revenue: int = 0, now: Optional[float] = None) -> None:
+        # draft — черновик заявки (drafts.Draft): из него берётся формат и отметка, был ли он уже на этом шаге
+        bit = _STEP_BITS[step]
+        if draft is None:
+            first, format_code = True, ""
+        else:
+            first = not draft.steps & bit
+            draft.steps |= bit
+            format_code = draft.format_code or ""
+        key = (self.day(now), step, format_code)
+        counters = self._pending.get(key)
+        if counters is None:
+            counters = self._pending[key] = [0, 0, 0]
+        counters[0] += first
+        counters[1] += 1
+        counters[2] += revenue
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _take(self) -> Dict[Tuple[str, str, str], Counters]:
+        # Забираем накопленное в потоке event loop, а пишем в базу уже без гонки с record()
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def _write(self, pending: Dict[Tuple[str, str, str], Counters]) -> None:
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(_UPSERT, [(*key, *counters) for key, counters in pending.items()])
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _restore(self, pending: Dict[Tuple[str, str, str], Counters]) -> None:
+        # Запись не удалась — счётчики возвращаются в буфер и уйдут со следующей
+        for key, counters in pending.items():
+            current = self._pending.setdefault(key, [0, 0, 0])
+            for index, value in enumerate(counters):
+                current[index] += value
+
+    def flush(self) -> int:
+        pending = self._take()
+        if pending:
+            try:
+                self._write(pending)
+            except sqlite3.Error:
+                self._restore(pending)
+                raise
+        return len(pending)
+
+    async def totals(self, since: date) -> Dict[Tuple[str, str], Counters]:
+        # (шаг, формат) -> счётчики за дни с since по сегодня; сначала дописываем буфер, чтобы отчёт был точным.
+        # Буфер забираем в event loop, а запись и чтение идут в пуле потоков
+        pending = self._take()
+        if pending:
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except sqlite3.Error:
+                self._restore(pending)
+                raise
+        return await asyncio.to_thread(self._query, since)
+
+    def _query(self, since: date) -> Dict[Tuple[str, str], Counters]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT step, format, SUM(entered), SUM(transitions), SUM(revenue) FROM funnel_daily "
+                "WHERE day >= ? GROUP BY step, format",
+                (since.isoformat(),),
+            ).fetchall()
+        return {(step, format_code): [entered, transitions, revenue] for step, format_code, entered, transitions, revenue in rows}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Остаток буфера записываем при остановке, чтобы рестарт не терял переходы
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to flush funnel stats: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            pending = self._take()
+            if not pending:
+                continue
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to flush funnel stats: {e}")
+                self._restore(pending)
+
+
+def funnel_callback(funnel: FunnelStats, state_names: Dict[object, str], callback: Callable, entry: bool = False) -> Callable:
+    # Состояние, которое вернул обработчик диалога, — переход воронки; END и «остаться на месте» (None) не считаются
+    async def wrapper(update, context):
+        new_state = await callback(update, context)
+        step = state_names.get(new_state)
+        if entry or step is not None:
+            draft = get_draft(context.user_data)
+            if entry:
+                funnel.record("START", draft)
+            if step is not None:
+                funnel.record(step, draft)
+        return new_state
+    return wrapper
+
+
+def track_transitions(handler: ConversationHandler, funnel: FunnelStats, state_names: Dict[object, str]) -> None:
+    for entry in handler.entry_points:
+        entry.callback = funnel_callback(funnel, state_names, entry.callback, entry=True)
+    for state_handlers in handler.states.values():
+        for state_handler in state_handlers:
+            state_handler.callback = funnel_callback(funnel, state_names, state_handler.callback)
+    for fallback in handler.fallbacks:
+        fallback.callback = funnel_callback(funnel, state_names, fallback.callback)
@@ -0,0 +1,89 @@
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from storage import connect
+
+# Локальное хранилище заявок с индексами по пользователю Telegram, нормализованному телефону и времени.
+# Проверка дубля — один запрос по индексам за окно времени; админ может искать заявки без прокрутки чата.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    name TEXT,
+    phone TEXT,
+    phone_norm TEXT,
+    time TEXT,
+    address TEXT,
+    format_code TEXT,
+    format_label TEXT,
+    format_price TEXT,
+    comment TEXT
+);
+CREATE INDEX IF NOT EXISTS leads_user_created ON leads (user_id, created_at);
+CREATE INDEX IF NOT EXISTS leads_phone_created ON leads (phone_norm, created_at);
+CREATE INDEX IF NOT EXISTS leads_created ON leads (created_at);
+"""
+
+_LEAD_FIELDS = ("name", "phone", "time", "address", "format_code", "format_label", "format_price", "comment")
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    # "+7 (900) 123-45-67", "8 900 1234567" и "9001234567" -> "79001234567"
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = "7" + digits
+    return digits
+
+
+class LeadStore:
+    def __init__(self, path: str) -> None:
+        self._conn = connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+
+    def add(self, user_id: int, username: Optional[str], data: dict, created_at: Optional[float] = None) -> int:
+        values = [data.get(field) for field in _LEAD_FIELDS]
+        with self._db_lock:
+            cursor = self._conn.execute(
+                f"INSERT INTO leads (created_at, user_id, username, phone_norm, {', '.join(_LEAD_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in _LEAD_FIELDS)})",
+                [created_at or time.time(), user_id, username, normalize_phone(data.get("phone")), *values],
+            )
+        return cursor.lastrowid
+
+    def find_duplicate(self, user_id: int, phone: Optional[str], window: float, now: Optional[float] = None) -> Optional[sqlite3.Row]:
+        since = (now or time.time()) - window
+        phone_norm = normalize_phone(phone) or None
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT * FROM leads WHERE (user_id = ? OR phone_norm = ?) AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (user_id, phone_norm, since),
+            ).fetchone()
+
+    def recent(self, limit: int = 10) -> List[sqlite3.Row]:
+        with self._db_lock:
+            return self._conn.execute("SELECT * FROM leads ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+
+    def by_phone(self, phone: str, limit: int = 10) -> List[sqlite3.Row]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT * FROM leads WHERE phone_norm = ? ORDER BY created_at DESC LIMIT ?",
+                (normalize_phone(phone), limit),
+            ).fetchall()
+
+    def by_user(self, user_id: int, limit: int = 10) -> List[sqlite3.Row]:
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT * FROM leads WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
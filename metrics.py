@@ -0,0 +1,220 @@
+import asyncio
+import bisect
+import functools
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram.error import BadRequest, InvalidToken, NetworkError, TelegramError
+from telegram.ext import ApplicationHandlerStop, BaseHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# Все значения меняются из одного event loop, поэтому блокировки не нужны.
+
+LabelValues = Tuple[str, ...]
+
+# Границы корзин гистограмм задержки, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]) -> None:
+        # Значение снимается в момент отдачи метрик
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self) -> Iterable[str]:
+        yield f"{self.name} {self.function()}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_label = f'le="{le}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, bucket_label)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "xenon_handler_latency_seconds", "Handler callback latency by state and callback", ("state", "handler")))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "xenon_handler_errors_total", "Handler callbacks that raised", ("state", "handler")))
+BOT_API_LATENCY = REGISTRY.register(Histogram(
+    "xenon_bot_api_latency_seconds", "Bot API request latency by method", ("method",)))
+BOT_API_ERRORS = REGISTRY.register(Counter(
+    "xenon_bot_api_errors_total", "Failed Bot API requests by method and error type", ("method", "error")))
+UPDATE_QUEUE_LAG = REGISTRY.register(Histogram(
+    "xenon_update_queue_lag_seconds", "Time from update arrival to start of processing"))
+THROTTLED_UPDATES = REGISTRY.register(Counter(
+    "xenon_throttled_updates_total", "Updates dropped by per-user flood control", ("kind",)))
+
+
+# --- Обработчики ---
+
+def timed_callback(state: str, callback: Callable) -> Callable:
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Штатная остановка обработки (так flood_guard отбрасывает апдейт), а не ошибка обработчика
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(state, name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, state, name)
+    return wrapper
+
+
+def instrument_handlers(handlers: Iterable[BaseHandler], state_names: Dict[object, str]) -> None:
+    # Оборачиваем callback каждого обработчика замером времени; для диалога метка — имя состояния
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            for entry in handler.entry_points:
+                entry.callback = timed_callback("ENTRY", entry.callback)
+            for state, state_handlers in handler.states.items():
+                for state_handler in state_handlers:
+                    state_handler.callback = timed_callback(state_names.get(state, str(state)), state_handler.callback)
+            for fallback in handler.fallbacks:
+                fallback.callback = timed_callback("FALLBACK", fallback.callback)
+        else:
+            handler.callback = timed_callback("GLOBAL", handler.callback)
+
+
+# --- Bot API ---
+
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[float] = None
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            result = await super().post(url, *args, **kwargs)
+        except TelegramError as e:
+            BOT_API_ERRORS.inc(method, type(e).__name__)
+            # Для health-check важны только проблемы связи, а не ошибки в параметрах запроса
+            if isinstance(e, InvalidToken) or (isinstance(e, NetworkError) and not isinstance(e, BadRequest)):
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.last_error_at = time.monotonic()
+            raise
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - started, method)
+        self.last_success = time.monotonic()
+        return result
+
+
+# --- Health ---
+
+class LoopMonitor:
+    # Раз в interval секунд проверяет, насколько event loop опаздывает с запуском задачи
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.lag = 0.0
+        self.last_tick: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self.last_tick = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            self.lag = max(0.0, self.last_tick - started - self.interval)
+
+    def stalled(self) -> bool:
+        # Тик давно не приходил: loop завис или монитор не запущен
+        return self.last_tick is None or time.monotonic() - self.last_tick > self.interval * 5
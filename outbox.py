@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Union
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from ratelimit import TokenBucket
+from storage import connect
+
+# Очередь уведомлений администратору (outbox).
+# Заявка сначала сохраняется в SQLite, пользователь сразу получает ответ,
+# а фоновый воркер доставляет сообщения в админский чат с ретраями и экспоненциальной паузой,
+# не превышая лимит Telegram для групп (около 20 сообщений в минуту).
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt_at, id);
+"""
+
+# На сколько секунд воркер забирает сообщение себе перед отправкой: несколько процессов
+# с общей базой не отправят одно и то же сообщение дважды, а упавший процесс не заблокирует его навсегда
+CLAIM_TIMEOUT = 60.0
+# Пауза после ошибки общей базы (например, её дольше busy_timeout держит транзакция другого процесса)
+DB_RETRY_DELAY = 5.0
+# Лимит Telegram на длину сообщения; содержимое собираем не длиннее MAX_MESSAGE_LENGTH, оставляя запас на заголовок
+TELEGRAM_MAX_LENGTH = 4096
+MAX_MESSAGE_LENGTH = 3900
+
+
+def parse_chat_id(chat_id: str) -> Union[int, str]:
+    try:
+        return int(chat_id)
+    except ValueError:
+        return chat_id  # на случай, если chat_id не числовой (@channel)
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    # Части не длиннее limit по границам строк; строка длиннее limit (например, огромный комментарий) режется
+    if len(text) <= limit:
+        return [text]
+    parts: List[str] = []
+    lines: List[str] = []
+    length = 0
+    for line in text.split("\n"):
+        for piece in [line[i:i + limit] for i in range(0, len(line), limit)] or [""]:
+            if lines and length + 1 + len(piece) > limit:
+                parts.append("\n".join(lines))
+                lines, length = [], 0
+            length += len(piece) + (1 if lines else 0)
+            lines.append(piece)
+    parts.append("\n".join(lines))
+    return parts
+
+
+def insert_message(conn: sqlite3.Connection, chat_id: Union[int, str], text: str) -> int:
+    # Отдельно от AdminOutbox, чтобы постановку в очередь можно было сделать в чужой транзакции (см. digest.py).
+    # Длинный текст ставится несколькими сообщениями: Telegram отклонил бы его целиком, и повтор бы не помог
+    now = time.time()
+    for part in split_text(text, TELEGRAM_MAX_LENGTH):
+        cursor = conn.execute(
+            "INSERT INTO outbox (chat_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+            (str(chat_id), part, now, now),
+        )
+    return cursor.lastrowid
+
+
+class AdminOutbox:
+    def __init__(
+        self,
+        path: str,
+        messages_per_minute: float = 20,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+    ) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        # Запас в один токен: сообщения идут равномерно, и за любые 60 секунд уходит не больше messages_per_minute.
+        # С полным запасом на старте бурст плюс пополнение дали бы почти вдвое больше лимита группы
+        self._bucket = TokenBucket(rate=messages_per_minute / 60, capacity=1.0)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, chat_id: Union[int, str], text: str) -> int:
+        # Запись в общую базу: обработчики вызывают enqueue через asyncio.to_thread,
+        # чтобы транзакция другого процесса не останавливала event loop
+        with self._db_lock:
+            message_id = insert_message(self._conn, chat_id, text)
+        self.notify()
+        return message_id
+
+    def notify(self) -> None:
+        # Разбудить воркер: в очереди появились сообщения. Можно вызывать и из пула потоков
+        wakeup = self._wakeup
+        if wakeup is not None:
+            self._loop.call_soon_threadsafe(wakeup.set)
+
+    def pending_count(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def start(self, bot: Bot) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        # Недоставленные сообщения остаются в базе и уйдут после рестарта
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._wakeup = None
+
+    def _next_due(self):
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, chat_id, text, attempts, next_attempt_at FROM outbox "
+                "ORDER BY next_attempt_at, id LIMIT 1"
+            ).fetchone()
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            # Сбрасываем флаг до выборки, чтобы не пропустить enqueue во время запроса
+            self._wakeup.clear()
+            try:
+                await self._send_next(bot)
+            except sqlite3.Error as e:
+                # Сбой базы не должен останавливать очередь до рестарта: сообщения остаются в ней и уйдут позже
+                logging.error(f"Admin outbox database error: {e}")
+                await asyncio.sleep(DB_RETRY_DELAY)
+
+    async def _send_next(self, bot: Bot) -> None:
+        # Запросы к общей базе — в пуле потоков: транзакция другого воркера может держать блокировку до busy_timeout
+        row = await asyncio.to_thread(self._next_due)
+        if row is None:
+            await self._wait(None)
+            return
+        message_id, chat_id, text, attempts, next_attempt_at = row
+        wait = next_attempt_at - time.time()
+        if wait > 0:
+            await self._wait(wait)
+            return
+        if not await asyncio.to_thread(self._claim, message_id, next_attempt_at):
+            # Сообщение забрал другой процесс
+            return
+        # Лимит группового чата: ждём токен перед каждой отправкой
+        delay = self._bucket.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._bucket.delay()
+        self._bucket.try_acquire()
+        try:
+            await bot.send_message(chat_id=parse_chat_id(chat_id), text=text)
+        except RetryAfter as e:
+            # Ограничение действует на весь чат — ставим на паузу всю очередь
+            logging.warning(f"Admin chat is throttled, retrying in {e.retry_after}s")
+            await asyncio.to_thread(self._reschedule, message_id, attempts, time.time(), str(e))
+            await asyncio.sleep(e.retry_after)
+        except BadRequest as e:
+            # Telegram отклонил само сообщение (неверный chat_id, разметка): повтор не поможет, заявка остаётся в /leads
+            logging.error(f"Admin message #{message_id} was rejected, dropping it: {e}")
+            await asyncio.to_thread(self._delete, message_id)
+        except (TelegramError, OSError) as e:
+            retry_in = min(self.base_delay * 2 ** attempts, self.max_delay)
+            logging.error(f"Failed to send admin message #{message_id} (attempt {attempts + 1}): {e}")
+            await asyncio.to_thread(self._reschedule, message_id, attempts + 1, time.time() + retry_in, str(e))
+        else:
+            await asyncio.to_thread(self._delete, message_id)
+
+    async def _wait(self, timeout: Optional[float]) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _claim(self, message_id: int, next_attempt_at: float) -> bool:
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND next_attempt_at = ?",
+                (time.time() + CLAIM_TIMEOUT, message_id, next_attempt_at),
+            )
+        return cursor.rowcount == 1
+
+    def _delete(self, message_id: int) -> None:
+        with self._db_lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    def _reschedule(self, message_id: int, attempts: int, next_attempt_at: float, error: str) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, error, message_id),
+            )
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Dict, Hashable, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import ConversationDict, ConversationKey, CDCData
+
+from storage import connect, dumps
+
+# Persistence с отложенной записью (write-behind) в SQLite.
+# Application сам раз в update_interval отдаёт изменённые user_data и состояния диалогов;
+# мы складываем их в буфер и пишем одной транзакцией в фоновом потоке.
+# При остановке Application вызывает flush(), который дописывает всё, что осталось.
+# Храним только то, что нужно для записи: user_data и состояния ConversationHandler.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+# Ключ буфера: (таблица, ключ строки); значение — JSON строки, None означает удаление строки.
+# В JSON значение переводится сразу, в потоке event loop: user_data и черновики живые и меняются обработчиками,
+# поток записи получает только готовые строки и никогда не читает сами объекты
+_PendingKey = Tuple[str, Hashable]
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, path: str, update_interval: float = 10) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._pending: Dict[_PendingKey, Optional[str]] = {}
+        self._write_task: Optional[asyncio.Task] = None
+
+    # --- Загрузка при старте ---
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        rows = self._conn.execute("SELECT user_id, data FROM user_data").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        rows = self._conn.execute("SELECT chat_id, data FROM chat_data").fetchall()
+        return {chat_id: json.loads(data) for chat_id, data in rows}
+
+    async def get_bot_data(self) -> dict:
+        row = self._conn.execute("SELECT data FROM bot_data WHERE id = 0").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def get_callback_data(self) -> Optional[CDCData]:
+        return None
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    # --- Отложенная запись ---
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        self._stage(("conversations", (name, json.dumps(list(key)))), None if new_state is None else json.dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage(("user_data", user_id), dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage(("chat_data", chat_id), dumps(data))
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._stage(("bot_data", 0), dumps(data))
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage(("user_data", user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage(("chat_data", chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Дожидаемся фоновой записи и дописываем остаток буфера
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            self._write_batch(self._take_pending())
+        logging.info(f"Persistence flushed to {self.path}")
+
+    def _stage(self, pending_key: _PendingKey, value: Optional[str]) -> None:
+        self._pending[pending_key] = value
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    def _take_pending(self) -> Dict[_PendingKey, Optional[str]]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    async def _write_pending(self) -> None:
+        # Даём Application отдать весь пакет изменений, затем пишем его одной транзакцией
+        await asyncio.sleep(0)
+        while self._pending:
+            batch = self._take_pending()
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logging.error(f"Failed to write persistence batch: {e}")
+                # Возвращаем неудавшиеся записи в буфер, более свежие значения не затираем
+                for pending_key, value in batch.items():
+                    self._pending.setdefault(pending_key, value)
+                return
+
+    def _write_batch(self, batch: Dict[_PendingKey, Optional[str]]) -> None:
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for (table, key), value in batch.items():
+                    self._write_row(table, key, value)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _write_row(self, table: str, key: Hashable, value: Optional[str]) -> None:
+        if table == "conversations":
+            name, key_json = key
+            if value is None:
+                self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key_json))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    (name, key_json, value),
+                )
+            return
+        id_column = {"user_data": "user_id", "chat_data": "chat_id", "bot_data": "id"}[table]
+        if value is None:
+            self._conn.execute(f"DELETE FROM {table} WHERE {id_column} = ?", (key,))
+        else:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({id_column}, data) VALUES (?, ?)",
+                (key, value),
+            )
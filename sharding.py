@@ -0,0 +1,323 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import threading
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+from telegram.ext import ConversationHandler
+
+from catalog import reload_catalog
+from concurrency import OrderedApplication
+from storage import connect, dumps
+
+# Горизонтальное масштабирование: несколько воркеров бота за диспетчером (dispatcher.py).
+# Диспетчер отправляет апдейты пользователя всегда одному воркеру по consistent hashing,
+# а состояние диалога и user_data лежат в общем хранилище. Воркер перед обработкой апдейта
+# сверяет версию состояния пользователя и при необходимости подгружает его, после обработки —
+# записывает с проверкой версии. Поэтому воркеры можно добавлять и убирать: пользователь,
+# переехавший на другой воркер, продолжает диалог с того же шага.
+
+
+# --- Consistent hashing ---
+
+def routing_key(data: dict) -> Optional[int]:
+    # Тот же ключ, что у ordering_key в concurrency.py, но по сырому JSON апдейта, без разбора в объекты
+    chat_id = None
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and chat_id is None:
+            chat_id = chat.get("id")
+    return chat_id
+
+
+class HashRing:
+    # Каждый узел занимает replicas точек на кольце, поэтому при добавлении или удалении узла
+    # переезжает примерно 1/N пользователей, а не все
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100) -> None:
+        self.replicas = replicas
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            i = bisect.bisect_left(self._points, point)
+            self._points.insert(i, point)
+            self._owners.insert(i, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def nodes_for(self, key: Hashable) -> List[str]:
+        # Владелец ключа и следующие по кольцу узлы — на случай, если владелец недоступен
+        if not self._points:
+            return []
+        i = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        result: List[str] = []
+        for owner in self._owners[i:] + self._owners[:i]:
+            if owner not in result:
+                result.append(owner)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+    def node_for(self, key: Hashable) -> Optional[str]:
+        nodes = self.nodes_for(key)
+        return nodes[0] if nodes else None
+
+
+# --- Общее хранилище состояния ---
+
+class UserState(NamedTuple):
+    version: int
+    user_data: dict
+    # [[имя ConversationHandler, ключ диалога списком, состояние], ...]
+    conversations: list
+
+
+class StateStore:
+    # Интерфейс общего хранилища; SQLiteStateStore подходит для воркеров на одной машине и для тестов,
+    # для нескольких машин нужна сетевая реализация с теми же методами
+    def load(self, key: Hashable) -> Optional[UserState]:
+        raise NotImplementedError
+
+    def save(self, key: Hashable, version: int, user_data: str, conversations: str, expected_version: int) -> bool:
+        # Записывает состояние, только если в хранилище всё ещё expected_version (0 — записи ещё нет).
+        # user_data и conversations — готовый JSON: сериализует вызывающий, в потоке event loop
+        raise NotImplementedError
+
+    def delete(self, key: Hashable, expected_version: int) -> bool:
+        # Удаляет состояние, только если в хранилище всё ещё expected_version
+        raise NotImplementedError
+
+    def catalog_version(self) -> int:
+        # Номер перезагрузки каталога форматов: воркер, увидевший новый номер, перечитывает formats.json
+        raise NotImplementedError
+
+    def bump_catalog_version(self) -> int:
+        raise NotImplementedError
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    user_data TEXT NOT NULL,
+    conversations TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shared_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, path: str) -> None:
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+
+    def load(self, key: Hashable) -> Optional[UserState]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version, user_data, conversations FROM shared_state WHERE key = ?", (str(key),)
+            ).fetchone()
+        if row is None:
+            return None
+        return UserState(row[0], json.loads(row[1]), json.loads(row[2]))
+
+    def save(self, key: Hashable, version: int, user_data: str, conversations: str, expected_version: int) -> bool:
+        values = (version, user_data, conversations, str(key))
+        with self._db_lock:
+            if expected_version == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO shared_state (version, user_data, conversations, key) VALUES (?, ?, ?, ?)", values
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE shared_state SET version = ?, user_data = ?, conversations = ? WHERE key = ? AND version = ?",
+                    values + (expected_version,),
+                )
+        return cursor.rowcount == 1
+
+    def delete(self, key: Hashable, expected_version: int) -> bool:
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM shared_state WHERE key = ? AND version = ?", (str(key), expected_version)
+            )
+        return cursor.rowcount == 1
+
+    def catalog_version(self) -> int:
+        with self._db_lock:
+            row = self._conn.execute("SELECT version FROM shared_versions WHERE name = 'catalog'").fetchone()
+        return row[0] if row is not None else 0
+
+    def bump_catalog_version(self) -> int:
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO shared_versions (name, version) VALUES ('catalog', 1) "
+                    "ON CONFLICT (name) DO UPDATE SET version = version + 1"
+                )
+                version = self._conn.execute("SELECT version FROM shared_versions WHERE name = 'catalog'").fetchone()[0]
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return version
+
+
+# --- Воркер ---
+
+class ShardedApplication(OrderedApplication):
+    # Вместо BasePersistence (которая читает всё один раз при старте и пишет с задержкой)
+    # состояние пользователя синхронизируется с общим хранилищем вокруг каждого его апдейта.
+    # Ключ диалога — (chat_id, user_id), в личном чате оба равны ключу упорядочивания
+    def __init__(self, state_store: StateStore, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.state_store = state_store
+        # Версия состояния, которая сейчас в памяти этого воркера
+        self._versions: Dict[Hashable, int] = {}
+        self._conversation_handlers: Optional[List[ConversationHandler]] = None
+        # Номер перезагрузки каталога форматов, который сейчас в памяти; None — каталог загружен при старте
+        self._catalog_version: Optional[int] = None
+
+    def _conversations(self) -> List[ConversationHandler]:
+        if self._conversation_handlers is None:
+            self._conversation_handlers = [
+                handler for handlers in self.handlers.values() for handler in handlers
+                if isinstance(handler, ConversationHandler) and handler.name
+            ]
+        return self._conversation_handlers
+
+    async def _process_in_lane(self, key: Hashable, update: object) -> None:
+        await self._load_state(key)
+        try:
+            await super()._process_in_lane(key, update)
+        finally:
+            await self._save_state(key)
+
+    def drop_user_data(self, user_id: int) -> None:
+        # Удаление из памяти (например, брошенного черновика) удаляет и строку в общем хранилище,
+        # иначе при следующем апдейте воркер загрузил бы состояние обратно, а таблица и _versions
+        # росли бы с каждым пользователем, который когда-либо писал боту
+        super().drop_user_data(user_id)
+        expected = self._versions.get(user_id)
+        self.create_task(self.run_in_lane(user_id, lambda: self._delete_state(user_id, expected)))
+
+    async def _delete_state(self, key: Hashable, expected: Optional[int]) -> None:
+        if expected is None or self._versions.get(key) != expected:
+            # Состояние этого воркера не записывалось, или после удаления уже пришёл апдейт и записал новое
+            return
+        if any(conversation_key[-1] == key for handler in self._conversations() for conversation_key in handler._conversations):
+            # Пользователь всё ещё в диалоге: без user_data, но состояние диалога сохраняем
+            await self._save_state(key)
+            return
+        if not await asyncio.to_thread(self.state_store.delete, key, expected):
+            logging.warning(f"State of {key} was changed by another worker, keeping the stored version")
+        self._versions.pop(key, None)
+
+    def mark_user_changed(self, key: Hashable) -> None:
+        # Запись — в полосе пользователя, после текущей работы в ней: не пересекается с _load_state апдейта
+        self.create_task(self.run_in_lane(key, lambda: self._save_state(key)))
+
+    async def refresh_user_state(self, key: Hashable) -> bool:
+        # Вызывается в полосе key. Если версию в хранилище изменил другой воркер (пользователь переехал
+        # после изменения списка воркеров), копия в памяти устарела: убираем её, решать за пользователя будет его воркер
+        state = await asyncio.to_thread(self.state_store.load, key)
+        version = state.version if state is not None else 0
+        if self._versions.get(key) == version:
+            return True
+        self._evict(key)
+        return False
+
+    def _evict(self, key: Hashable) -> None:
+        # Убрать состояние пользователя только из памяти воркера; в хранилище оно остаётся
+        self._user_data.pop(key, None)
+        self._versions.pop(key, None)
+        for handler in self._conversations():
+            conversations = handler._conversations
+            for conversation_key in [k for k in conversations if k[-1] == key]:
+                del conversations[conversation_key]
+
+    async def catalog_reloaded(self) -> None:
+        # /reload_formats и SIGHUP попадают только в один воркер; остальные увидят новый номер перед апдейтом
+        self._catalog_version = await asyncio.to_thread(self.state_store.bump_catalog_version)
+
+    def _check_catalog(self, version: int) -> None:
+        if self._catalog_version is None or self._catalog_version == version:
+            self._catalog_version = version
+            return
+        # Каталог перезагрузили в другом воркере: перечитываем тот же formats.json
+        self._catalog_version = version
+        try:
+            reload_catalog()
+            logging.info("Format catalog reloaded after another worker")
+        except Exception as e:
+            logging.error(f"Failed to reload formats: {e}")
+
+    def _read_state(self, key: Hashable):
+        # Состояние пользователя и номер каталога — одним походом в пул потоков
+        return self.state_store.load(key), self.state_store.catalog_version()
+
+    async def _load_state(self, key: Hashable) -> None:
+        state, catalog_version = await asyncio.to_thread(self._read_state, key)
+        self._check_catalog(catalog_version)
+        version = state.version if state is not None else 0
+        if self._versions.get(key) == version:
+            return
+        # Пользователь пришёл впервые или его состояние менял другой воркер
+        self._versions[key] = version
+        self._user_data[key] = dict(state.user_data) if state is not None else {}
+        # Внутренний словарь диалогов ConversationHandler: публичного способа подменить состояние нет
+        for handler in self._conversations():
+            conversations = handler._conversations
+            for conversation_key in [k for k in conversations if k[-1] == key]:
+                del conversations[conversation_key]
+            for name, conversation_key, conversation_state in (state.conversations if state is not None else ()):
+                if name == handler.name:
+                    conversations[tuple(conversation_key)] = conversation_state
+
+    async def _save_state(self, key: Hashable) -> None:
+        expected = self._versions.get(key, 0)
+        conversations = [
+            [handler.name, list(conversation_key), conversation_state]
+            for handler in self._conversations()
+            for conversation_key, conversation_state in handler._conversations.items()
+            if conversation_key[-1] == key
+        ]
+        # Сериализуем здесь, а не в потоке записи: обработчики в event loop могут менять черновик,
+        # пока запись ждёт базу, и в хранилище попал бы наполовину изменённый объект
+        version = expected + 1
+        user_data = dumps(self._user_data.get(key) or {})
+        if await asyncio.to_thread(self.state_store.save, key, version, user_data, json.dumps(conversations), expected):
+            self._versions[key] = version
+        else:
+            # Апдейт этого пользователя одновременно обработал другой воркер (момент перебалансировки).
+            # Его запись побеждает, наша версия сбрасывается и перечитается при следующем апдейте
+            logging.warning(f"State of {key} was changed by another worker, keeping the stored version")
+            self._versions.pop(key, None)
@@ -0,0 +1,230 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from datetime import time as day_time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from storage import connect
+
+# Запись на сессию по свободным окнам. Расписание специалиста (рабочие часы по дням недели) задаётся в JSON,
+# занятые окна лежат в таблице bookings и дублируются в памяти в индексе интервалов.
+# Бронирование атомарно: проверка пересечения и вставка идут в одной транзакции BEGIN IMMEDIATE.
+
+DEFAULT_SCHEDULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schedule.json")
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    slot_start INTEGER NOT NULL UNIQUE,
+    slot_end INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class Slot:
+    start: int
+    end: int
+
+    @property
+    def callback_data(self) -> str:
+        return f"slot_{self.start}"
+
+
+class IntervalIndex:
+    # Непересекающиеся полуинтервалы [start, end), отсортированные по началу.
+    # Раз интервалы не пересекаются, концы отсортированы в том же порядке, и проверка пересечения — один bisect
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()) -> None:
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        for start, end in sorted(intervals):
+            self.add(start, end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect.bisect_left(self._starts, end)
+        return i > 0 and self._ends[i - 1] > start
+
+    def add(self, start: int, end: int) -> None:
+        if self.overlaps(start, end):
+            raise ValueError(f"Interval [{start}, {end}) overlaps an existing one")
+        i = bisect.bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+    def remove_before(self, moment: int) -> None:
+        # Прошедшие интервалы больше не нужны для поиска свободных окон
+        i = bisect.bisect_right(self._ends, moment)
+        del self._starts[:i]
+        del self._ends[:i]
+
+
+class Schedule:
+    def __init__(
+        self,
+        timezone: str,
+        slot_minutes: int,
+        weekly: Dict[int, List[Tuple[day_time, day_time]]],
+        horizon_days: int = 14,
+        min_notice_minutes: int = 0,
+        days_off: Iterable[date] = (),
+        buttons: int = 8,
+    ) -> None:
+        if slot_minutes <= 0:
+            raise ValueError("slot_minutes must be positive")
+        self.tz = ZoneInfo(timezone)
+        self.step = timedelta(minutes=slot_minutes)
+        self.weekly = weekly
+        self.horizon_days = horizon_days
+        self.min_notice = min_notice_minutes * 60
+        self.days_off = frozenset(days_off)
+        self.buttons = buttons
+        # Окна одного дня не меняются, поэтому строим их один раз на дату
+        self._day_cache: Dict[date, Tuple[Slot, ...]] = {}
+
+    def _day_slots(self, day: date) -> Tuple[Slot, ...]:
+        slots = self._day_cache.get(day)
+        if slots is None:
+            if len(self._day_cache) > self.horizon_days * 2 + 2:
+                self._day_cache.clear()
+            slots = self._day_cache[day] = tuple(self._build_day_slots(day))
+        return slots
+
+    def _build_day_slots(self, day: date) -> Iterator[Slot]:
+        if day in self.days_off:
+            return
+        for begin, finish in self.weekly.get(day.weekday(), ()):
+            cursor = datetime.combine(day, begin, self.tz)
+            stop = datetime.combine(day, finish, self.tz)
+            while cursor + self.step <= stop:
+                end = cursor + self.step
+                yield Slot(int(cursor.timestamp()), int(end.timestamp()))
+                cursor = end
+
+    def _bookable(self, slot: Slot, now: float) -> bool:
+        today = datetime.fromtimestamp(now, self.tz).date()
+        slot_day = datetime.fromtimestamp(slot.start, self.tz).date()
+        return slot.start >= now + self.min_notice and (slot_day - today).days <= self.horizon_days
+
+    def slots(self, now: Optional[float] = None) -> Iterator[Slot]:
+        # Все окна по расписанию от текущего момента до конца горизонта, по возрастанию
+        now = now or time.time()
+        earliest = now + self.min_notice
+        today = datetime.fromtimestamp(now, self.tz).date()
+        for offset in range(self.horizon_days + 1):
+            for slot in self._day_slots(today + timedelta(days=offset)):
+                if slot.start >= earliest:
+                    yield slot
+
+    def slot_at(self, start: int, now: Optional[float] = None) -> Optional[Slot]:
+        # Окно по времени начала из callback_data; None, если такого окна в расписании нет или оно уже прошло
+        day = datetime.fromtimestamp(start, self.tz).date()
+        for slot in self._day_slots(day):
+            if slot.start == start:
+                return slot if self._bookable(slot, now or time.time()) else None
+        return None
+
+
+def load_schedule(path: str) -> Schedule:
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    weekly = {
+        WEEKDAYS.index(name): [(day_time.fromisoformat(begin), day_time.fromisoformat(finish)) for begin, finish in windows]
+        for name, windows in config.get("weekly", {}).items()
+    }
+    return Schedule(
+        config.get("timezone", "Europe/Moscow"),
+        int(config["slot_minutes"]),
+        weekly,
+        horizon_days=int(config.get("horizon_days", 14)),
+        min_notice_minutes=int(config.get("min_notice_minutes", 0)),
+        days_off=[date.fromisoformat(day) for day in config.get("days_off", [])],
+        buttons=int(config.get("buttons", 8)),
+    )
+
+
+def schedule_path() -> str:
+    return os.getenv("SCHEDULE_PATH", DEFAULT_SCHEDULE_PATH)
+
+
+class SlotBook:
+    def __init__(self, path: str, schedule: Schedule) -> None:
+        self.schedule = schedule
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT slot_start, slot_end FROM bookings WHERE slot_end > ?", (time.time(),)).fetchall()
+        self._index = IntervalIndex(rows)
+
+    def free_slots(self, limit: int, now: Optional[float] = None) -> List[Slot]:
+        now = now or time.time()
+        self._index.remove_before(int(now))
+        free = []
+        for slot in self.schedule.slots(now):
+            if not self._index.overlaps(slot.start, slot.end):
+                free.append(slot)
+                if len(free) >= limit:
+                    break
+        return free
+
+    def keyboard(self, label: Callable[[Slot], str], now: Optional[float] = None) -> Optional[InlineKeyboardMarkup]:
+        # Свободные окна кнопками по два в ряд; подпись кнопки (на языке пользователя) даёт label. None, если окон нет
+        free = self.free_slots(self.schedule.buttons, now)
+        if not free:
+            return None
+        buttons = [InlineKeyboardButton(label(slot), callback_data=slot.callback_data) for slot in free]
+        return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+    def find_free(self, start: int, now: Optional[float] = None) -> Optional[Slot]:
+        slot = self.schedule.slot_at(start, now)
+        if slot is None or self._index.overlaps(slot.start, slot.end):
+            return None
+        return slot
+
+    async def book(self, slot: Slot, user_id: int) -> Optional[int]:
+        # Возвращает id брони или None, если окно уже занято (в том числе другим процессом).
+        # Транзакция в общей базе идёт в пуле потоков, индекс занятых окон меняется только в event loop
+        clash, booking_id = await asyncio.to_thread(self._insert_booking, slot, user_id)
+        if clash is not None:
+            # Бронь сделал другой процесс — подтягиваем её в индекс
+            if not self._index.overlaps(*clash):
+                self._index.add(*clash)
+            return None
+        self._index.add(slot.start, slot.end)
+        return booking_id
+
+    def _insert_booking(self, slot: Slot, user_id: int) -> Tuple[Optional[Tuple[int, int]], Optional[int]]:
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                clash = self._conn.execute(
+                    "SELECT slot_start, slot_end FROM bookings WHERE slot_start < ? AND slot_end > ? LIMIT 1",
+                    (slot.end, slot.start),
+                ).fetchone()
+                booking_id = None
+                if clash is None:
+                    cursor = self._conn.execute(
+                        "INSERT INTO bookings (slot_start, slot_end, user_id, created_at) VALUES (?, ?, ?, ?)",
+                        (slot.start, slot.end, user_id, time.time()),
+                    )
+                    booking_id = cursor.lastrowid
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return clash, booking_id
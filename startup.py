@@ -0,0 +1,89 @@
+import time
+
+# Отсчёт запуска — до всех остальных импортов
+_PROCESS_STARTED = time.perf_counter()
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from webserver import HttpServer, Request, Response
+
+# Быстрый холодный старт: python startup.py вместо python bot.py.
+# Порт открывается до импорта telegram: health-check сразу получает ответ «starting»,
+# а webhook-запросы, пришедшие во время запуска, не отклоняются (Telegram повторил бы их с задержкой),
+# а ждут готовности бота. Тяжёлые импорты идут в отдельном потоке, event loop в это время отвечает на запросы.
+# По каждой фазе запуска в лог пишется отчёт о времени.
+
+
+class StartupProfile:
+    def __init__(self, started: Optional[float] = None) -> None:
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        # Фаза длится от предыдущей отметки до этой
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        lines += [f"    {phase:<24}{duration * 1000:>8.1f} ms" for phase, duration in self.phases]
+        lines.append(f"    {'total':<24}{(self._last - self.started) * 1000:>8.1f} ms")
+        return "\n".join(lines)
+
+
+async def starting_route(request: Request) -> Response:
+    body = json.dumps({"status": "starting"}).encode()
+    return Response(200, body, "application/json")
+
+
+async def boot(profile: StartupProfile) -> None:
+    # Интерпретатор, стандартная библиотека и запуск event loop
+    profile.mark("runtime")
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    profile.mark("dotenv")
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        logging.error("BOT_TOKEN не задан. Поместите токен вашего бота в переменную окружения BOT_TOKEN.")
+        return
+    mode = os.getenv("BOT_MODE", "polling").lower()
+
+    server = HttpServer("0.0.0.0", int(os.environ.get("PORT", 10000)))
+    ready = asyncio.Event()
+
+    async def held_webhook_route(request: Request) -> Response:
+        # Настоящий маршрут регистрирует bot.serve; до этого запрос просто ждёт
+        await ready.wait()
+        return await server.dispatch(request)
+
+    server.route("GET", "/", starting_route)
+    server.route("GET", "/healthz", starting_route)
+    if mode in ("webhook", "worker"):
+        server.route("POST", "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/"), held_webhook_route)
+    await server.start()
+    profile.mark("http server")
+
+    bot = await asyncio.to_thread(importlib.import_module, "bot")
+    profile.mark("imports")
+    application = bot.application_for_mode(token, mode, profile)
+    await bot.serve(application, mode, server=server, profile=profile, on_ready=ready.set)
+
+
+def main() -> None:
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    try:
+        asyncio.run(boot(StartupProfile(_PROCESS_STARTED)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import json
+import os
+import sqlite3
+
+# Общая SQLite-база бота: состояние диалогов, очереди и прочие служебные таблицы
+DEFAULT_DATABASE_PATH = "xenon_prive.db"
+
+
+def database_path() -> str:
+    return os.getenv("DATABASE_PATH", DEFAULT_DATABASE_PATH)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # check_same_thread=False: запись идёт из пула потоков, доступ сериализуем сами
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _to_dict(value: object) -> dict:
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def dumps(value: object) -> str:
+    # JSON для user_data: объекты с to_dict() (черновик заявки) пишутся словарём, обратно их восстанавливает владелец
+    return json.dumps(value, ensure_ascii=False, default=_to_dict)
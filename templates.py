@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+from string import Formatter
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+# Тексты бота на нескольких языках: locales/<язык>.json, ключ -> шаблон в синтаксисе str.format (или список строк).
+# Шаблоны разбираются один раз при загрузке: плейсхолдеры проверяются сразу, а не при первой отправке,
+# и каждый компилируется в функцию с f-строкой: рендер — тот же байткод, что у f-строк в обработчиках, без разбора шаблона.
+# Новый язык — новый JSON, код обработчиков не меняется.
+
+DEFAULT_LOCALES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+DEFAULT_LANGUAGE = "ru"
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _compile(parsed: List[tuple]) -> Optional[Callable[[dict], str]]:
+    # Шаблон -> lambda values: 'текст' f"{values['имя']:формат}" ... (соседние литералы склеиваются в одну f-строку).
+    # None, если в шаблоне есть то, что f-строка повторит не дословно (индексы [..], вложенные поля в формате), —
+    # тогда рендерит str.format_map
+    parts = []
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        name, *attributes = field.split(".")
+        if not name.isidentifier() or any(not attr.isidentifier() or attr.startswith("_") for attr in attributes):
+            return None
+        if any(char in spec for char in "{}'\"\\\n"):
+            return None
+        expression = f"values[{name!r}]" + "".join("." + attr for attr in attributes)
+        parts.append('f"{' + expression + ("!" + conversion if conversion else "") + (":" + spec if spec else "") + '}"')
+    source = "lambda values: " + (" ".join(parts) or "''")
+    try:
+        return eval(source, {})
+    except SyntaxError as e:
+        # Сюда не должен попасть шаблон, прошедший проверки Template, но ошибка всё равно — ошибка перевода
+        raise TemplateError(f"Template cannot be compiled: {e.msg}") from None
+
+
+class Template:
+    __slots__ = ("text", "fields", "render")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        try:
+            parsed = list(Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template {text!r}: {e}") from None
+        fields = set()
+        for _, field, _, conversion in parsed:
+            if field is None:
+                continue
+            name = field.split(".", 1)[0].split("[", 1)[0]
+            if not name or name.isdigit():
+                # Позиционные {} и {0} запрещены: переводчик может поменять порядок слов
+                raise TemplateError(f"Template {text!r} must use named placeholders")
+            if conversion not in (None, "s", "r", "a"):
+                raise TemplateError(f"Template {text!r}: unknown conversion !{conversion}")
+            fields.add(name)
+        self.fields: FrozenSet[str] = frozenset(fields)
+        # render(values) — values словарём, без распаковки в именованные аргументы
+        try:
+            self.render: Callable[[dict], str] = _compile(parsed) or text.format_map
+        except TemplateError as e:
+            raise TemplateError(f"{e} in {text!r}") from None
+
+
+class Locale:
+    def __init__(self, code: str, templates: Dict[str, Template], lists: Dict[str, Tuple[str, ...]]) -> None:
+        self.code = code
+        self._templates = templates
+        self._lists = lists
+
+    def __call__(self, key: str, **values) -> str:
+        return self._templates[key].render(values)
+
+    def render(self, key: str, values: dict) -> str:
+        # То же, что texts(key, **values), но без упаковки аргументов — для частых сообщений вроде сводки заявки
+        return self._templates[key].render(values)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._templates or key in self._lists
+
+    def list(self, key: str) -> Tuple[str, ...]:
+        return self._lists[key]
+
+    def __repr__(self) -> str:
+        return f"Locale({self.code!r})"
+
+
+def _parse_locale(code: str, data: dict) -> Locale:
+    if not isinstance(data, dict):
+        raise TemplateError(f"Locale {code}: expected a JSON object")
+    templates: Dict[str, Template] = {}
+    lists: Dict[str, Tuple[str, ...]] = {}
+    for key, value in data.items():
+        if isinstance(value, str):
+            try:
+                templates[key] = Template(value)
+            except TemplateError as e:
+                raise TemplateError(f"Locale {code}, key {key}: {e}") from None
+        elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+            lists[key] = tuple(value)
+        else:
+            raise TemplateError(f"Locale {code}, key {key}: expected a string or a list of strings")
+    return Locale(code, templates, lists)
+
+
+def _check_against(default: Locale, locale: Locale) -> None:
+    # Язык по умолчанию задаёт набор ключей и плейсхолдеров; перевод может не использовать плейсхолдер,
+    # но не может требовать значение, которого обработчик не передаёт
+    for key, template in locale._templates.items():
+        reference = default._templates.get(key)
+        if reference is None:
+            raise TemplateError(f"Locale {locale.code}: unknown key {key}")
+        extra = template.fields - reference.fields
+        if extra:
+            raise TemplateError(f"Locale {locale.code}, key {key}: unknown placeholders {', '.join(sorted(extra))}")
+    for key, items in locale._lists.items():
+        reference_items = default._lists.get(key)
+        if reference_items is None:
+            raise TemplateError(f"Locale {locale.code}: unknown key {key}")
+        if len(items) != len(reference_items):
+            raise TemplateError(f"Locale {locale.code}, key {key}: expected {len(reference_items)} items")
+    missing = [key for key in list(default._templates) + list(default._lists) if key not in locale]
+    if missing:
+        # Недостающие строки берутся из языка по умолчанию, чтобы частичный перевод не ломал бота
+        logging.warning(f"Locale {locale.code} has no translation for: {', '.join(missing)}")
+        for key in missing:
+            if key in default._templates:
+                locale._templates[key] = default._templates[key]
+            else:
+                locale._lists[key] = default._lists[key]
+
+
+class TemplateRegistry:
+    def __init__(self, locales: Dict[str, Locale], default: str = DEFAULT_LANGUAGE) -> None:
+        if default not in locales:
+            raise TemplateError(f"No locale file for the default language {default}")
+        self.locales = locales
+        self.default = locales[default]
+        # language_code из Telegram ("en", "en-US", "pt-br", ...) -> локаль; кодов немного, кэшируем навсегда
+        self._resolved: Dict[Optional[str], Locale] = {}
+
+    def get(self, language_code: Optional[str]) -> Locale:
+        locale = self._resolved.get(language_code)
+        if locale is None:
+            code = (language_code or "").lower().replace("_", "-")
+            locale = self.locales.get(code) or self.locales.get(code.split("-", 1)[0]) or self.default
+            self._resolved[language_code] = locale
+        return locale
+
+
+def load_templates(path: str, default: str = DEFAULT_LANGUAGE) -> TemplateRegistry:
+    locales: Dict[str, Locale] = {}
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".json"):
+            continue
+        code = name[:-len(".json")].lower()
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise TemplateError(f"Locale {code}: {e}") from None
+        locales[code] = _parse_locale(code, data)
+    registry = TemplateRegistry(locales, default)
+    for locale in locales.values():
+        if locale is not registry.default:
+            _check_against(registry.default, locale)
+    return registry
+
+
+def locales_path() -> str:
+    return os.getenv("LOCALES_PATH", DEFAULT_LOCALES_PATH)
+
+
+_registry: Optional[TemplateRegistry] = None
+
+
+def get_templates() -> TemplateRegistry:
+    # Загружается один раз на процесс; ошибка в файлах перевода останавливает запуск, а не всплывает в диалоге
+    global _registry
+    if _registry is None:
+        _registry = load_templates(locales_path())
+    return _registry
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Минимальный HTTP/1.1 сервер поверх asyncio: принимает webhook-запросы Telegram
+# и отвечает на health-check Render на одном порту и в одном event loop с ботом.
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+
+RouteHandler = Callable[[Request], Awaitable[Response]]
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# Телеграм присылает апдейты размером в единицы килобайт, больше 1 МБ не принимаем
+MAX_BODY_SIZE = 1024 * 1024
+# Сколько ждём следующий запрос на keep-alive соединении
+KEEP_ALIVE_TIMEOUT = 75.0
+# Сколько stop() ждёт, пока обработчики открытых соединений дописывают ответы
+STOP_TIMEOUT = 5.0
+
+
+class HttpServer:
+    def __init__(self, host: str = "0.0.0.0", port: int = 10000) -> None:
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], RouteHandler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Открытые соединения и задачи, которые их обслуживают
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    def route(self, method: str, path: str, handler: RouteHandler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logging.info(f"HTTP server is listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        # Keep-alive соединения сервер сам не закрывает: без этого их обработчики отменяются
+        # уже при остановке event loop. Закрытое соединение завершает чтение следующего запроса,
+        # а начатый запрос успевает получить ответ
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    await self._write_response(writer, Response(400, str(e).encode()), keep_alive=False)
+                    break
+                if request is None:
+                    break
+                response = await self.dispatch(request)
+                if request.method == "HEAD":
+                    response = response._replace(body=b"")
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise ValueError("Malformed request line")
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body is too large")
+        body = await reader.readexactly(length) if length else b""
+        path, _, query = target.partition("?")
+        return Request(method.upper(), path, query, headers, body)
+
+    async def dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            # HEAD обслуживаем тем же обработчиком, что и GET
+            if request.method == "HEAD":
+                handler = self._routes.get(("GET", request.path))
+            if handler is None:
+                if any(path == request.path for _, path in self._routes):
+                    return Response(405)
+                return Response(404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logging.error(f"HTTP handler for {request.method} {request.path} failed: {e}")
+            return Response(500)
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        reason = _REASONS.get(response.status, "")
+        head = (
+            f"HTTP/1.1 {response.status} {reason}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()